@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# bench_dbitem.py
+# Micro-benchmark for parsing database lines into DBItems.
+#
+# Compares the label parser against the regular expressions it replaced
+# on a generated 100k line database file.
+#
+# ./benchmarks/bench_dbitem.py [lines]
+#
+import os
+import re
+import sys
+import tempfile
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+from xxcmd import DBItem  # noqa: E402
+
+
+# The original regex based parser
+def regex_parse(line):
+    label = ""
+    post = re.match(r'.*(\[(.*)\])$', line)
+    pre = re.match(r'^(\[(.*)\])(.*)$', line)
+    if post:
+        label = post.group(2)
+        line = re.sub(r'(\[(.*)\])$', '', line)
+    elif pre:
+        label = pre.group(2)
+        line = re.sub(r'^(\[(.*)\])', '', line)
+    return label.strip(), line.strip()
+
+
+# Write a database file with a mix of line styles
+def make_database(filename, count):
+    with open(filename, "wt") as outfile:
+        for i in range(count):
+            if i % 3 == 0:
+                outfile.write("ssh -i ~/.ssh/key{0}.pem me@host{0} [SSH {0}]\n".format(i))
+            elif i % 3 == 1:
+                outfile.write("[Find {0}] find . -name '*.py' | xargs grep -n "
+                              "'pattern {0}' | sort | uniq -c\n".format(i))
+            else:
+                outfile.write("echo \"[not a label {0}]\" && ls -al /tmp\n".format(i))
+
+
+def timeit(func, lines):
+    start = time.perf_counter()
+    for line in lines:
+        func(line)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    filename = tempfile.mktemp()
+    make_database(filename, count)
+    with open(filename, "rt") as infile:
+        lines = [x.strip() for x in infile.readlines()]
+    os.unlink(filename)
+
+    old = timeit(regex_parse, lines)
+    new = timeit(DBItem.parse, lines)
+    items = timeit(DBItem, lines)
+    print("{0} lines".format(count))
+    print("regex parser:   {0:.3f}s".format(old))
+    print("label parser:   {0:.3f}s ({1:.1f}x)".format(new, old / new))
+    print("DBItem create:  {0:.3f}s".format(items))
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+# bench_startup.py
+# Benchmark for the time taken to import xxcmd.
+#
+# Uses python -X importtime to report the total import time and the
+# slowest modules imported, best of a number of runs.
+#
+# ./benchmarks/bench_startup.py [runs]
+#
+import os
+import sys
+import subprocess
+
+
+# Import xxcmd in a fresh interpreter, return {module: cumulative usecs}
+def import_times():
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import xxcmd'],
+        cwd=os.path.join(os.path.dirname(__file__), os.pardir),
+        stderr=subprocess.PIPE, check=True)
+    times = {}
+    for line in result.stderr.decode('utf-8').splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[12:].split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    best = None
+    for i in range(runs):
+        times = import_times()
+        if best is None or times['xxcmd'] < best['xxcmd']:
+            best = times
+    print("import xxcmd: {0:.1f}ms (best of {1})".format(
+        best['xxcmd'] / 1000, runs))
+    print("slowest imports:")
+    for name, usecs in sorted(best.items(), key=lambda x: -x[1])[1:11]:
+        print("  {0:<30} {1:.1f}ms".format(name, usecs / 1000))
@@ -40,6 +40,18 @@ class stdscr:
     def addch(cls, y, x, ch):
         pass
 
+    @classmethod
+    def timeout(cls, delay):
+        pass
+
+    @classmethod
+    def noutrefresh(cls):
+        pass
+
+    @classmethod
+    def touchwin(cls):
+        pass
+
 
 class curses:
 
@@ -50,6 +62,9 @@ class curses:
     ACS_LTEE = 4
     ACS_RTEE = 5
 
+    class error(Exception):
+        pass
+
     @classmethod
     def initscr(cls):
         return stdscr
@@ -78,6 +93,10 @@ class curses:
     def curs_set(cls, value):
         pass
 
+    @classmethod
+    def doupdate(cls):
+        pass
+
     @classmethod
     def newwin(cls, y, x, w, h):
         return stdscr()
@@ -3,12 +3,16 @@ import locale
 import unittest
 import tempfile
 import sys
+import shutil
+import subprocess
 from contextlib import contextmanager
 import io
-from .mockcurses import curses
+from unittest.mock import patch
+from .mockcurses import curses, stdscr
 import xxcmd
-from xxcmd import CmdManager, DBItem, main
+from xxcmd import CmdManager, DBItem, main, consoleui
 from xxcmd.config import Config
+from xxcmd.dbcache import DatabaseCache
 from xxcmd.cmdmanager import UnitTestException
 
 # Mock curses during unit testing
@@ -29,9 +33,18 @@ def captured_output():
 
 class CmdManagerTests(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.cachedir = tempfile.mkdtemp()
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.cachedir)
+
     def get_xx(self):
         xx = CmdManager()
         xx.filename = self.testfile()
+        xx.cachedir = self.cachedir
         xx.config.sort_by_label = False
         xx.config.sort_by_command = False
         # Don't load global system database
@@ -60,9 +73,47 @@ class CmdManagerTests(unittest.TestCase):
         data = xx.get_file_contents('/invalid/path')
         self.assertFalse(data)
 
+    def test_iter_file_lines(self):
+        xx = self.get_xx()
+        filename = tempfile.mktemp()
+        with open(filename, "wb") as outfile:
+            outfile.write(b"one\r\n two \r\nthree\rfour\n\nfive")
+        self.assertEqual(
+            list(xx.iter_file_lines(filename)),
+            ['one', 'two', 'three', 'four', '', 'five'])
+        # Stop early
+        lines = xx.iter_file_lines(filename)
+        self.assertEqual(next(lines), 'one')
+        lines.close()
+        # Empty file
+        with open(filename, "wb") as outfile:
+            pass
+        self.assertEqual(xx.get_file_contents(filename), [])
+        os.unlink(filename)
+
+    def test_iter_database(self):
+        xx = self.get_xx()
+        xx.config.load_global_database = True
+        xx.sysfilename = self.testfile() + '2'
+        filename = tempfile.mktemp()
+        with open(filename, "wt") as outfile:
+            outfile.write("ls -al [My Command]\nps [Procs]\n")
+        xx.filename = filename
+        items = list(xx.iter_database())
+        self.assertEqual([x.cmd for x in items], ['ls -al', 'clear && ls -l', 'ps'])
+        self.assertTrue(xx.is_global(items[0]))
+        self.assertFalse(xx.is_global(items[2]))
+        # Nothing was loaded into our database
+        self.assertEqual(xx.database, [])
+        os.unlink(filename)
+
     def test_import_from_url(self):
         xx = self.get_xx()
-        xx.import_database_url('file://' + self.testfile())
+        xx.filename = tempfile.mktemp()
+        result = xx.import_database_url('file://' + self.testfile())
+        self.assertEqual((result.added, result.duplicates), (2, 0))
+        self.assertEqual(result.lines, 2)
+        self.assertEqual(result.bytes, os.path.getsize(self.testfile()))
 
         data = xx.database
 
@@ -75,6 +126,12 @@ class CmdManagerTests(unittest.TestCase):
         self.assertFalse(data[1].label.startswith(' '))
         self.assertFalse(data[1].label.endswith(' '))
 
+        # Importing again only finds duplicates
+        result = xx.import_database_url('file://' + self.testfile())
+        self.assertEqual((result.added, result.duplicates), (0, 2))
+        self.assertEqual(len(xx.get_file_contents(xx.filename)), 2)
+        os.unlink(xx.filename)
+
     def test_load_and_save_database(self):
         xx = self.get_xx()
 
@@ -113,6 +170,312 @@ class CmdManagerTests(unittest.TestCase):
             data[5],
             'cat /proc/cpuinfo | grep "model name" | sort | uniq -c [CPUs]')
 
+    def test_database_cache(self):
+        filename = tempfile.mktemp()
+        with open(filename, "wt") as outfile:
+            outfile.write("ls [List]\n\n[Top] top\n")
+        xx = self.get_xx()
+        xx.filename = filename
+        xx.load_databases()
+        self.assertEqual(len(xx.database), 2)
+        cache = DatabaseCache(xx.cachedir)
+        self.assertEqual(
+            [x.search_key() for x in cache.load(filename)],
+            ['list ls', 'top top'])
+
+        # Loads from the cache without reading the file
+        xx = self.get_xx()
+        xx.get_file_contents = None
+        items = xx.get_file_items(filename)
+        self.assertEqual(items[1].label, 'Top')
+
+        # Changing the file invalidates the cache
+        with open(filename, "at") as outfile:
+            outfile.write("[Another] ps\n")
+        self.assertIsNone(cache.load(filename))
+        xx = self.get_xx()
+        xx.filename = filename
+        xx.load_databases()
+        self.assertEqual(len(xx.database), 3)
+        self.assertEqual(len(cache.load(filename)), 3)
+        os.unlink(filename)
+
+    def test_journal(self):
+        filename = tempfile.mktemp()
+        with open(filename, "wt") as outfile:
+            outfile.write("ls [List]\n[Top] top\n")
+        xx = self.get_xx()
+        xx.filename = filename
+        xx.config.database_journal = True
+        xx.load_databases()
+
+        # Changes are appended to the journal
+        xx.add_database_entry('[Procs] ps')
+        xx.delete_database_entry(xx.database[0])
+        xx.ui.input.set_value('')
+        xx.update_search()
+        xx.ui.input.set_value('Table')
+        xx.update_selected_label()
+        self.assertEqual(
+            xx.get_file_contents(filename), ['ls [List]', '[Top] top'])
+        self.assertEqual(xx.get_file_contents(xx.journal_filename()), [
+            '+ ps [Procs]', '- ls [List]', '- top [Top]', '= top [Table]'])
+
+        # Loading replays the journal
+        expected = [(x.cmd, x.label) for x in xx.database]
+        other = self.get_xx()
+        other.filename = filename
+        other.load_databases()
+        self.assertEqual([(x.cmd, x.label) for x in other.database], expected)
+        self.assertEqual(
+            sorted((x.cmd, x.label) for x in other.iter_database()),
+            sorted(expected))
+
+        # Compaction rewrites the database
+        xxcmd.cmdmanager.JOURNAL_COMPACT_THRESHOLD = 5
+        try:
+            xx.add_database_entry('[Disk] df')
+            self.assertTrue(os.path.isfile(xx.journal_filename()))
+            xx.add_database_entry('[Free] free')
+        finally:
+            xxcmd.cmdmanager.JOURNAL_COMPACT_THRESHOLD = 100
+        self.assertFalse(os.path.isfile(xx.journal_filename()))
+        self.assertEqual(xx.get_file_contents(filename), [
+            'top [Table]', 'ps [Procs]', 'df [Disk]', 'free [Free]'])
+        os.unlink(filename)
+
+    def test_merge_on_save(self):
+        filename = tempfile.mktemp()
+        with open(filename, "wt") as outfile:
+            outfile.write("ls [List]\n")
+        first = self.get_xx()
+        second = self.get_xx()
+        for xx in (first, second):
+            xx.filename = filename
+            xx.load_databases()
+        first.add_database_entry('[Top] top')
+        second.add_database_entry('[Procs] ps')
+        second.delete_database_entry(second.database[0])
+        self.assertEqual(
+            sorted(second.get_file_contents(filename)),
+            ['ps [Procs]', 'top [Top]'])
+        self.assertEqual(len(second.database), 2)
+
+        # With a journal
+        first.config.database_journal = True
+        second.config.database_journal = True
+        first.load_databases()
+        second.add_database_entry('[Disk] df')
+        first.add_database_entry('[Free] free')
+        second.delete_database_entry(second.database[0])
+        second.config.database_journal = False
+        second.save_database()
+        self.assertFalse(os.path.isfile(second.journal_filename()))
+        self.assertEqual(
+            sorted(second.get_file_contents(filename)),
+            ['df [Disk]', 'free [Free]', 'top [Top]'])
+        os.unlink(filename)
+        os.unlink(filename + '.lock')
+
+    def test_concurrent_adds(self):
+        filename = tempfile.mktemp()
+        env = dict(os.environ, XDG_CACHE_HOME=self.cachedir)
+        cwd = os.path.join(os.path.dirname(__file__), os.pardir)
+        procs = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'xxcmd', '-g', '-f', filename,
+                 '-a', '[Cmd {0}] echo {0}'.format(i)],
+                cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+            for i in range(8)]
+        for proc in procs:
+            proc.wait()
+        xx = self.get_xx()
+        self.assertEqual(
+            sorted(xx.get_file_contents(filename)),
+            ['echo {0} [Cmd {0}]'.format(i) for i in range(8)])
+        os.unlink(filename)
+        os.unlink(filename + '.lock')
+
+    def test_fuzzy_search(self):
+        xx = self.get_xx()
+        xx.load_data([
+            "[List Files] ls -al",
+            "[Logs] tail -f /var/log/syslog",
+            "[Git Status] git status",
+            "[Stuff] grep -s x",
+            "[Processes] ps aux"])
+        xx.config.fuzzy_search = True
+        for term, labels in [
+                ('g', ['Git Status', 'Logs', 'Stuff']),
+                ('gs', ['Git Status', 'Logs', 'Stuff']),
+                ('gst', ['Git Status']),
+                ('gs', ['Git Status', 'Logs', 'Stuff']),
+                ('xyz', [])]:
+            xx.ui.input.set_value(term)
+            xx.update_search()
+            self.assertEqual([x.label for x in xx.results], labels)
+        # Narrowed searches find the same as fresh ones
+        xx._database_changed()
+        xx.ui.input.set_value('gst')
+        xx.update_search()
+        self.assertEqual([x.label for x in xx.results], ['Git Status'])
+
+        xx.config.search_labels_only = True
+        xx.ui.input.set_value('gs')
+        xx.update_search()
+        self.assertEqual([x.label for x in xx.results], ['Git Status', 'Logs'])
+        xx.config.fuzzy_limit = 1
+        xx.update_search()
+        self.assertEqual([x.label for x in xx.results], ['Git Status'])
+
+        # Back to normal searches
+        xx.config.fuzzy_search = False
+        xx.update_search()
+        self.assertEqual([x.label for x in xx.results], ['Logs'])
+
+    def test_sqlite_add_then_search(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp() + '.db'
+        xx.load_databases()
+        xx.add_database_entry('[Listing] ls')
+        xx.ui.input.set_value('list')
+        xx.update_search()
+        # New items are only found once, as they're stored
+        xx.edit_newcmd_mode()
+        xx.ui.input.insert('[List all] ls -al')
+        xx.add_new_command()
+        self.assertEqual(xx.ui.input.value, 'list')
+        xx.ui.input.set_value('lis')
+        xx.update_search()
+        self.assertEqual(
+            sorted(x.label for x in xx.results), ['List all', 'Listing'])
+        xx.ui.input.set_value('list')
+        xx.update_search()
+        self.assertEqual(
+            sorted(x.label for x in xx.results), ['List all', 'Listing'])
+        xx.store.close()
+        os.unlink(xx.filename)
+
+    def test_sqlite_full_save(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp() + '.db'
+        xx.load_databases()
+        xx.add_database_entries(['[a] one', '[b] two', '[c] three'])
+        # Items removed without saving are removed from the store by a
+        # full save
+        xx.save_disabled = True
+        xx.delete_database_entry(xx.database[1])
+        xx.save_disabled = False
+        xx.save_database()
+        self.assertEqual(
+            [x.label for x in xx.store.iter_items()], ['a', 'c'])
+        xx.store.close()
+        os.unlink(xx.filename)
+
+    def test_sqlite_streaming(self):
+        home = tempfile.mkdtemp()
+        with open(os.path.join(home, '.xxcmd'), 'w') as f:
+            f.write("[Text] from text\n")
+        with patch.dict(os.environ, {'HOME': home}):
+            xx = self.get_xx()
+            xx.config.database_backend = 'sqlite'
+            xx.filename = xxcmd.cmdmanager.DEFAULT_SQLITE_DATABASE_FILE
+            dbname = os.path.join(home, '.xxcmd.db')
+            # Before the SQLite database exists we stream the text one
+            self.assertEqual(
+                [x.label for x in xx.iter_user_items()], ['Text'])
+            self.assertFalse(os.path.exists(dbname))
+            # Then the SQLite one, without writing to it
+            self.assertTrue(xx.load_databases())
+            xx.store.close()
+            stat = os.stat(dbname)
+            self.assertEqual(
+                [x.label for x in xx.iter_user_items()], ['Text'])
+            self.assertEqual(os.stat(dbname).st_mtime_ns, stat.st_mtime_ns)
+        shutil.rmtree(home)
+
+    def test_sqlite_backend(self):
+        data = [
+            "one [My Label]",
+            "[Your Label] two",
+            "[Other] label three",
+            "three",
+            "[labels] labelled"]
+        plain = self.get_xx()
+        plain.load_data(data, False)
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp() + '.db'
+        self.assertFalse(xx.load_databases())
+        self.assertFalse(xx.database_exists)
+        xx.add_database_entries(data)
+        self.assertEqual(len(xx.store), 5)
+
+        # Searches match the text backend
+        for sort in ('', 'label', 'command'):
+            for case in (True, False):
+                for options in [(True, False), (False, True), (False, False)]:
+                    for term in ['lab', 'label', 'three', 'e', 'xyz', '']:
+                        for manager in (plain, xx):
+                            manager.config.sort_by_label = sort == 'label'
+                            manager.config.sort_by_command = sort == 'command'
+                            manager.config.sort_case_sensitive = case
+                            manager.config.search_labels_first = options[0]
+                            manager.config.search_labels_only = options[1]
+                            manager.ui.input.set_value(term)
+                            manager.update_search()
+                        self.assertEqual(
+                            [x.search_key() for x in plain.results],
+                            [x.search_key() for x in xx.results])
+
+        # Changes are saved
+        xx.config.sort_by_label = xx.config.sort_by_command = False
+        xx.ui.input.set_value('')
+        xx.update_search()
+        xx.ui.input.set_value('Renamed')
+        xx.update_selected_label()
+        xx.delete_database_entry(xx.database[1])
+        other = self.get_xx()
+        other.filename = xx.filename
+        other.config.load_global_database = True
+        other.sysfilename = self.testfile()
+        self.assertTrue(other.load_databases())
+        self.assertEqual(
+            [(x.cmd, x.label) for x in other.database[2:]],
+            [(x.cmd, x.label) for x in xx.database])
+        self.assertEqual(other.database[0].label, 'SSH Home')
+        self.assertEqual(other.database[2].label, 'Renamed')
+
+        # Global items are searched too
+        other.ui.input.set_value('h')
+        other.update_search()
+        self.assertEqual(
+            [x.label for x in other.results],
+            ['SSH Home', 'Other'])
+
+        # Export as text
+        self.assertEqual(
+            [x.cmd for x in other.iter_database()],
+            [x.cmd for x in other.database])
+        os.unlink(xx.filename)
+
+    def test_save_through_symlink(self):
+        filename = tempfile.mktemp()
+        link = tempfile.mktemp()
+        with open(filename, "wt") as outfile:
+            outfile.write("ls [List]\n")
+        os.chmod(filename, 0o640)
+        os.symlink(filename, link)
+        xx = self.get_xx()
+        xx.filename = link
+        xx.load_databases()
+        xx.add_database_entry('[Top] top')
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.stat(filename).st_mode & 0o777, 0o640)
+        self.assertEqual(
+            xx.get_file_contents(filename), ['ls [List]', 'top [Top]'])
+        os.unlink(link)
+        os.unlink(filename)
+
     def test_add_and_delete(self):
         xx = self.get_xx()
         xx.load_databases()
@@ -183,6 +546,87 @@ class CmdManagerTests(unittest.TestCase):
         xx.update_search()
         self.assertEqual(len(xx.results), 0)
 
+    def test_incremental_search(self):
+        xx = self.get_xx()
+        xx.load_data([
+            "one [My Label]",
+            "[Your Label] two",
+            "[Other] label three",
+            "three"], False)
+        xx.update_search()
+        # Typing narrows the earlier results
+        for key in 'label':
+            xx.ui.get_input(key)
+        self.assertEqual(2, len(xx.results))
+        xx.ui.get_input('x')
+        self.assertEqual(0, len(xx.results))
+        # Backspace restores the earlier results
+        xx.ui.get_input('KEY_BACKSPACE')
+        self.assertEqual(2, len(xx.results))
+        xx.ui.get_input('KEY_BACKSPACE')
+        xx.ui.get_input('KEY_BACKSPACE')
+        self.assertEqual(2, len(xx.results))
+        # Falls back to commands when no labels match
+        xx.ui.input.set_value('thr')
+        xx.update_search()
+        self.assertEqual(2, len(xx.results))
+        # Database changes are seen by the next search
+        xx.save_disabled = True
+        xx.add_database_entry('[Threes] 333')
+        xx.ui.input.set_value('thr')
+        xx.update_search()
+        self.assertEqual(1, len(xx.results))
+        xx.delete_database_entry(xx.results[0])
+        xx.update_search()
+        self.assertEqual(2, len(xx.results))
+        # Search option changes are seen by the next search
+        xx.config.search_labels_first = False
+        xx.update_search()
+        self.assertEqual(2, len(xx.results))
+        xx.config.search_labels_only = True
+        xx.update_search()
+        self.assertEqual(0, len(xx.results))
+
+    def test_search_index(self):
+        data = [
+            "one [My Label]",
+            "[Your Label] two",
+            "[Other] label three",
+            "three",
+            "[Labels] labelled"]
+        plain = self.get_xx()
+        plain.load_data(data, False)
+        xx = self.get_xx()
+        xx.config.search_index = True
+        xx.load_data(data, False)
+        self.assertEqual(len(xx.get_search_index()), 5)
+        xx.save_disabled = plain.save_disabled = True
+        xx.add_database_entry('[Lab] three')
+        plain.add_database_entry('[Lab] three')
+        for labels_first, labels_only in [
+                (True, False), (False, True), (False, False)]:
+            for term in ['lab', 'label', 'three', 'hree', 'thr', 'xyz', 'l']:
+                for manager in (plain, xx):
+                    manager.config.search_labels_first = labels_first
+                    manager.config.search_labels_only = labels_only
+                    manager.ui.input.set_value(term)
+                    manager.update_search()
+                self.assertEqual(
+                    [x.search_key() for x in plain.results],
+                    [x.search_key() for x in xx.results])
+        # Index follows edits and deletes
+        xx.ui.input.set_value('')
+        xx.update_search()
+        xx.ui.input.set_value('Renamed')
+        xx.update_selected_label()
+        xx.delete_database_entry(xx.database[1])
+        xx.ui.input.set_value('renamed')
+        xx.update_search()
+        self.assertEqual(xx.results, [xx.database[0]])
+        xx.ui.input.set_value('your')
+        xx.update_search()
+        self.assertEqual(xx.results, [])
+
     def test_curses_redraw(self):
         xx = self.get_xx()
         xx.load_databases()
@@ -196,8 +640,151 @@ class CmdManagerTests(unittest.TestCase):
         xx.ui.redraw()
         xx.ui.finalise_display()
 
+    def test_curses_redraw_damage(self):
+        xx = self.get_xx()
+        xx.load_databases()
+        xx.update_search()
+        xx.ui.initialise_display()
+        with patch.object(stdscr, 'addstr') as addstr, \
+                patch.object(stdscr, 'box') as box:
+            xx.ui.redraw()
+            rows = addstr.call_count
+            self.assertTrue(box.called)
+
+            # Nothing changed, nothing drawn
+            addstr.reset_mock()
+            box.reset_mock()
+            xx.ui.redraw()
+            self.assertEqual(addstr.call_count, 0)
+            self.assertFalse(box.called)
+
+            # Moving the selection draws the old and new rows
+            xx.selection_down()
+            xx.ui.redraw()
+            self.assertEqual(
+                [x[0][0] for x in addstr.call_args_list], [3, 3, 4, 4])
+            self.assertTrue(box.called)
+
+            # Typing draws the prompt and the rows which changed
+            addstr.reset_mock()
+            xx.ui.get_input('z')
+            xx.ui.redraw()
+            self.assertEqual(addstr.call_args_list[0][0][0], 1)
+            self.assertLess(addstr.call_count, rows)
+
+            # Dialogs mean drawing everything again
+            addstr.reset_mock()
+            xx.ui.confirm('test', 79)
+            xx.ui.redraw()
+            self.assertGreater(addstr.call_count, 1)
+        xx.ui.finalise_display()
+
+    def test_background_search(self):
+        xx = self.get_xx()
+        xx.load_data(["[label{0}] cmd{0}".format(i) for i in range(10000)])
+        xx.background_search = True
+        with patch.object(stdscr, 'getmaxyx', return_value=(24, 80)):
+            xx.ui.initialise_display()
+        xx.ui.input.set_value('label9')
+        with patch('xxcmd.cmdmanager.SEARCH_SLICE', 0):
+            xx.update_search()
+            self.assertTrue(xx.searching())
+            # Each slice shows what we've found so far
+            self.assertFalse(xx.continue_search())
+            self.assertEqual(len(xx.results), 111)
+            xx.ui.redraw()
+            prompt = xx.ui._drawn_rows[xx.ui.layout.prompt_y]
+            self.assertEqual(prompt[-1][1], consoleui.SEARCHING)
+            while not xx.continue_search():
+                pass
+        self.assertFalse(xx.searching())
+        self.assertEqual(len(xx.results), 1111)
+        self.assertEqual(xx.results[0].label, 'label9')
+        xx.ui.redraw()
+        prompt = xx.ui._drawn_rows[xx.ui.layout.prompt_y]
+        self.assertEqual(len(prompt), 1)
+
+        # Acting on the results finishes the search
+        xx.ui.input.set_value('label99')
+        xx.update_search()
+        xx.selected_row = 1
+        self.assertTrue(xx.searching())
+        self.assertEqual(xx.selected_item.label, 'label990')
+        self.assertFalse(xx.searching())
+        xx.ui.finalise_display()
+
+    def test_get_all_input(self):
+        xx = self.get_xx()
+        xx.load_databases()
+        xx.ui.initialise_display()
+        calls = []
+        keys = ['l', 's', '\n', 'x', curses.error]
+        with patch.object(stdscr, 'get_wch', create=True, side_effect=keys), \
+                patch.object(xx, 'update_search',
+                             side_effect=lambda: calls.append('search')), \
+                patch.object(xx, 'execute_selected_command',
+                             side_effect=lambda: calls.append('execute')):
+            xx.search_mode()
+            calls.clear()
+            xx.ui.get_all_input()
+        # One search for all the keys typed before each other action
+        self.assertEqual(calls, ['search', 'execute', 'search'])
+        self.assertEqual(xx.ui.input.value, 'lsx')
+        xx.ui.finalise_display()
+
+    def test_bracketed_paste(self):
+        xx = self.get_xx()
+        xx.load_databases()
+        xx.ui.initialise_display()
+        calls = []
+        keys = (list(consoleui.PASTE_START) + list('git log\n -n 5\n') +
+                list(consoleui.PASTE_END) + [curses.error])
+        with patch.object(stdscr, 'get_wch', create=True, side_effect=keys), \
+                patch.object(xx, 'update_search',
+                             side_effect=lambda: calls.append('search')):
+            xx.search_mode()
+            calls.clear()
+            xx.ui.get_all_input()
+        # Pasted all at once, with a single search
+        self.assertEqual(xx.ui.input.value, 'git log  -n 5')
+        self.assertEqual(calls, ['search'])
+
+        # Escape on its own is still escape
+        xx.edit_newcmd_mode()
+        keys = ['\x1b', '[', 'x', curses.error]
+        with patch.object(stdscr, 'get_wch', create=True, side_effect=keys):
+            xx.ui.get_all_input()
+        self.assertEqual(xx.mode, 'search')
+        self.assertEqual(xx.ui.input.value, 'git log  -n 5[x')
+        xx.ui.finalise_display()
+
+    def test_curses_resize(self):
+        xx = self.get_xx()
+        xx.load_databases()
+        xx.update_search()
+        xx.ui.initialise_display()
+        self.assertEqual((xx.ui.layout.height, xx.ui.layout.width), (80, 20))
+        self.assertEqual(
+            (xx.ui.layout.minx, xx.ui.layout.miny, xx.ui.layout.maxy),
+            (1, 3, 77))
+        # Our window size is only checked when it changes
+        with patch.object(stdscr, 'getmaxyx', return_value=(24, 40)) as size:
+            xx.ui.redraw()
+            xx.ui.print_line_at(1, 1, 'test')
+            self.assertFalse(size.called)
+            xx.ui.get_input('KEY_RESIZE')
+            self.assertEqual(size.call_count, 1)
+            self.assertEqual(
+                (xx.ui.layout.height, xx.ui.layout.width, xx.ui.layout.maxy),
+                (24, 40, 21))
+            # So everything is drawn again
+            self.assertEqual(xx.ui._drawn_rows, {})
+            xx.ui.redraw()
+        xx.ui.finalise_display()
+
     def test_execute(self):
         xx = self.get_xx()
+        xx.filename = tempfile.mktemp()
         xx.ui.initialise_display()
         # Execute nothing
         result = xx.execute_command(None, False)
@@ -205,6 +792,201 @@ class CmdManagerTests(unittest.TestCase):
         # Execute something
         result = xx.execute_command(DBItem('echo foo'), False)
         self.assertEqual(result, 'foo')
+        # Runs are only recorded if we sort by them
+        self.assertFalse(os.path.exists(xx.usage_filename()))
+        self.assertFalse(os.path.exists(xx.filename + '.lock'))
+        xx.config.sort_by_frecency = True
+        xx.execute_command(DBItem('echo foo'), False)
+        self.assertEqual(xx.get_usage().stats[('echo foo', '')][0], 1)
+        os.unlink(xx.usage_filename())
+        os.unlink(xx.filename + '.lock')
+
+    def test_label_width(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp()
+        xx.load_data([
+            "[a] one",
+            "[abcd] two",
+            "[abcd] three"])
+        self.assertEqual(xx.label_width(), 4)
+        xx.update_search()
+        self.assertEqual(xx.results.label_width(), 4)
+        xx.ui.input.set_value('one')
+        xx.update_search()
+        self.assertEqual(xx.results.label_width(), 1)
+
+        # Changes to the database keep our width
+        xx.add_database_entry('[abcdef] four')
+        self.assertEqual(xx.label_width(), 6)
+        xx.delete_database_entry(xx._item_keys[('four', 'abcdef')])
+        self.assertEqual(xx.label_width(), 4)
+        xx.delete_database_entry(xx._item_keys[('two', 'abcd')])
+        self.assertEqual(xx.label_width(), 4)
+        xx.ui.input.set_value('')
+        xx.update_search()
+        xx.selected_row = 1
+        xx.ui.input.set_value('ab')
+        xx.update_selected_label()
+        self.assertEqual(xx.label_width(), 2)
+        os.unlink(xx.filename)
+        os.unlink(xx.filename + '.lock')
+
+    def test_align_visible(self):
+        xx = self.get_xx()
+        xx.load_data(["[{0}] cmd{1}".format('x' * i, i) for i in range(200)])
+        xx.update_search()
+        xx.ui.initialise_display()
+        xx.config.align_commands = 'visible'
+        xx.ui.redraw()
+        # Commands line up with the longest label on screen, not the
+        # longest of all the results
+        layout = xx.ui.layout
+        rows = layout.maxy - layout.miny + 1
+        segments = xx.ui._drawn_rows[layout.miny]
+        self.assertEqual(
+            segments[1][0], layout.minx + rows - 1 + xx.config.label_padding)
+        xx.ui.finalise_display()
+
+    def test_sorted_database(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp()
+        xx.load_data([
+            "[delta] four",
+            "[Alpha] one",
+            "[charlie] three",
+            "[Bravo] two"])
+        xx.config.sort_by_label = True
+        xx.config.sort_case_sensitive = False
+
+        def check(term, labels):
+            xx.ui.input.set_value(term)
+            xx.update_search()
+            self.assertEqual([x.label for x in xx.results], labels)
+            # Our results came out in order, so needed no sorting
+            self.assertIsNone(xx.results._key)
+
+        check('', ['Alpha', 'Bravo', 'charlie', 'delta'])
+        check('a', ['Alpha', 'Bravo', 'charlie', 'delta'])
+        check('r', ['Bravo', 'charlie'])
+        # Changes keep our order
+        xx.add_database_entry('[Echo] five')
+        xx.add_database_entry('[Bob] six')
+        check('', ['Alpha', 'Bob', 'Bravo', 'charlie', 'delta', 'Echo'])
+        xx.selected_row = 0
+        xx.ui.input.set_value('Zulu')
+        xx.update_selected_label()
+        check('', ['Bob', 'Bravo', 'charlie', 'delta', 'Echo', 'Zulu'])
+        xx.delete_database_entry(xx.database[0])
+        check('', ['Bob', 'Bravo', 'charlie', 'Echo', 'Zulu'])
+        # The database itself keeps its order
+        self.assertEqual(
+            [x.label for x in xx.database],
+            ['Zulu', 'charlie', 'Bravo', 'Echo', 'Bob'])
+
+        # As do other sort orders
+        xx.config.sort_by_label = False
+        xx.config.sort_by_command = True
+        xx.config.sort_case_sensitive = True
+        check('', ['Echo', 'Zulu', 'Bob', 'charlie', 'Bravo'])
+        xx.config.sort_by_command = False
+        check('', ['Zulu', 'charlie', 'Bravo', 'Echo', 'Bob'])
+        os.unlink(xx.filename)
+        os.unlink(xx.filename + '.lock')
+
+    def test_sorted_database_edits(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp()
+        xx.config.sort_by_label = True
+        xx.load_data(['[same] one', '[same] two', '[same] three', '[a] x'])
+        xx.update_search()
+        # Edited items keep their database order amongst equal items
+        xx.selected_row = 1
+        xx.ui.input.set_value('edited')
+        xx.update_selected_command()
+        xx.update_search()
+        self.assertEqual(
+            [x.cmd for x in xx.results], ['x', 'edited', 'two', 'three'])
+        self.assertEqual(
+            list(xx.results), sorted(xx.database, key=xx.sort_key()))
+        os.unlink(xx.filename)
+        os.unlink(xx.filename + '.lock')
+
+    def test_search_index_off(self):
+        xx = self.get_xx()
+        xx.config.sort_by_label = True
+        xx.config.search_index = True
+        xx.load_data(['[zeta] abc1', '[alpha] abc2', '[mid] abc3', '[x] xyz'])
+        xx.ui.input.set_value('abc')
+        xx.update_search()
+        self.assertIsNotNone(xx._search_index)
+        # Turning our index off stops us using it
+        xx.config.search_index = False
+        xx.update_search()
+        self.assertEqual(
+            [x.label for x in xx.results], ['alpha', 'mid', 'zeta'])
+        self.assertIsNone(xx.get_search_index())
+
+    def test_sort_by_frecency_config(self):
+        home = tempfile.mkdtemp()
+        configfile = os.path.join(home, '.xxcmdrc')
+        with open(configfile, 'w') as f:
+            f.write("[xxcmd]\nsort-by-frecency = yes\n")
+        oldconfig = Config.DEFAULT_CONFIG_FILE
+        Config.DEFAULT_CONFIG_FILE = configfile
+        try:
+            with patch.dict(os.environ, {'HOME': home}):
+                xx = CmdManager()
+            self.assertTrue(xx.config.sort_by_frecency)
+            # Our usage follows our database
+            xx.filename = os.path.join(home, 'db')
+            xx.load_data(["[Alpha] one", "[Bravo] two"])
+            xx.get_usage().record(xx.database[1])
+            xx.update_search()
+            self.assertEqual([x.label for x in xx.results], ['Bravo', 'Alpha'])
+            self.assertEqual(
+                xx.get_usage().filename, os.path.join(home, 'db.usage'))
+        finally:
+            Config.DEFAULT_CONFIG_FILE = oldconfig
+            shutil.rmtree(home)
+
+    def test_sort_by_frecency(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp()
+        xx.load_data([
+            "[Alpha] one",
+            "[Bravo] two",
+            "[Charlie] three",
+            "[Delta] four"])
+        xx.config.sort_by_label = True
+        xx.config.sort_by_frecency = True
+        xx.update_search()
+        self.assertEqual(
+            [x.label for x in xx.results],
+            ['Alpha', 'Bravo', 'Charlie', 'Delta'])
+
+        # Record some runs, long ago and just now
+        usage = xx.get_usage()
+        for i in range(3):
+            usage.record(xx.database[1], 0)
+        usage.record(xx.database[2])
+        usage.record(xx.database[3])
+        usage.record(xx.database[3])
+        xx.update_search()
+        self.assertEqual(
+            [x.label for x in xx.results],
+            ['Delta', 'Charlie', 'Bravo', 'Alpha'])
+
+        # Runs are remembered, and work with other searches
+        xx._usage = None
+        xx.ui.input.set_value('a')
+        xx.update_search()
+        self.assertEqual(
+            [x.label for x in xx.results], ['Delta', 'Charlie', 'Bravo', 'Alpha'])
+        xx.ui.input.set_value('ha')
+        xx.update_search()
+        self.assertEqual([x.label for x in xx.results], ['Charlie', 'Alpha'])
+        os.unlink(xx.usage_filename())
+        os.unlink(xx.filename + '.lock')
 
     def test_selection(self):
         xx = self.get_xx()
@@ -347,12 +1129,56 @@ class CmdManagerTests(unittest.TestCase):
         xx.load_databases()
         self.assertRaises(UnitTestException, lambda: xx.run('#AUTOEXIT#'))
 
+    def test_quick_run(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp()
+        with open(xx.filename, "wt") as outfile:
+            outfile.write(
+                "[File Sizes] du -h .\n"
+                "[Processes] ps aux\n"
+                "[Show Procs] top\n"
+                "[Danger!] rm -rf /tmp/foo\n"
+                "[Other] sizes.sh\n")
+        ran = []
+        xx.execute_command = ran.append
+        # Single label match
+        self.assertTrue(xx.quick_run('SIZES'))
+        self.assertEqual(ran[0].cmd, 'du -h .')
+        # Ambiguous
+        self.assertFalse(xx.quick_run('proc'))
+        # No label matches, so search commands
+        self.assertTrue(xx.quick_run('aux'))
+        self.assertEqual(ran[1].cmd, 'ps aux')
+        self.assertFalse(xx.quick_run('nothing'))
+        # Confirmation required
+        self.assertFalse(xx.quick_run('danger'))
+        # Labels only
+        xx.config.search_labels_first = False
+        xx.config.search_labels_only = True
+        self.assertFalse(xx.quick_run('aux'))
+        # Search all
+        xx.config.search_labels_only = False
+        self.assertFalse(xx.quick_run('sizes'))
+        self.assertTrue(xx.quick_run('top'))
+        self.assertEqual(ran[2].cmd, 'top')
+        self.assertEqual(len(ran), 3)
+        self.assertEqual(xx.database, [])
+
+        # Fuzzy search matches what it would interactively
+        with open(xx.filename, "wt") as outfile:
+            outfile.write("[git status] git status\n[gist] gist\n")
+        xx.config.fuzzy_search = True
+        self.assertFalse(xx.quick_run('gist'))
+        self.assertTrue(xx.quick_run('gtst'))
+        self.assertEqual(ran[3].cmd, 'git status')
+        os.unlink(xx.filename)
+
     def test_tags(self):
         xx = self.get_xx()
         xx.load_databases()
         xx.save_disabled = True
         xx.add_database_entry('[TagTest] ls tag', ['tsttag'])
-        self.assertEqual(xx.database[len(xx.database)-1].tags[0], 'tsttag')
+        self.assertTrue('tsttag' in xx.database[len(xx.database)-1].tags)
 
     def test_newcmd(self):
         xx = self.get_xx()
@@ -376,34 +1202,35 @@ class CmdManagerTests(unittest.TestCase):
         self.assertFalse(ok)
 
     def test_main(self):
-        sys.argv = ['xx', '-v']
-        self.assertRaises(SystemExit, lambda: main())
-        sys.argv = ['xx', '#AUTOEXIT#']
-        self.assertRaises(Exception, lambda: main())
-        sys.argv = ['xx', '-tmnsbgep1', '#AUTOEXIT#']
-        self.assertRaises(Exception, lambda: main())
-
-        configfile = tempfile.mktemp()
-        Config.DEFAULT_CONFIG_FILE = configfile
-        sys.argv = ['xx', '-c']
-        self.assertRaises(SystemExit, lambda: main())
-        sys.argv = ['xx', '-c']
-        self.assertRaises(SystemExit, lambda: main())
-        sys.argv = ['xx', '-l']
-        self.assertRaises(SystemExit, lambda: main())
-        os.unlink(configfile)
-
-        dbfile = tempfile.mktemp()
-        sys.argv = ['xx', '-f', dbfile, '-i',
-                    'https://pastebin.com/raw/zVxMGmRJ']
-        self.assertRaises(SystemExit, lambda: main())
-        sys.argv = ['xx', '-f', dbfile, '-i', 'https://invalid']
-        self.assertRaises(SystemExit, lambda: main())
-        sys.argv = ['xx', '-f', dbfile, '-a', '[New] command']
-        self.assertRaises(SystemExit, lambda: main())
-        sys.argv = ['xx', '-f', dbfile, '-a', '[New] command']
-        self.assertRaises(SystemExit, lambda: main())
-        os.unlink(dbfile)
+        with patch('xxcmd.cmdmanager.DEFAULT_CACHE_DIR', self.cachedir):
+            sys.argv = ['xx', '-v']
+            self.assertRaises(SystemExit, lambda: main())
+            sys.argv = ['xx', '#AUTOEXIT#']
+            self.assertRaises(Exception, lambda: main())
+            sys.argv = ['xx', '-tmnsbgep1', '#AUTOEXIT#']
+            self.assertRaises(Exception, lambda: main())
+
+            configfile = tempfile.mktemp()
+            Config.DEFAULT_CONFIG_FILE = configfile
+            sys.argv = ['xx', '-c']
+            self.assertRaises(SystemExit, lambda: main())
+            sys.argv = ['xx', '-c']
+            self.assertRaises(SystemExit, lambda: main())
+            sys.argv = ['xx', '-l']
+            self.assertRaises(SystemExit, lambda: main())
+            os.unlink(configfile)
+
+            dbfile = tempfile.mktemp()
+            sys.argv = ['xx', '-f', dbfile, '-i',
+                        'https://pastebin.com/raw/zVxMGmRJ']
+            self.assertRaises(SystemExit, lambda: main())
+            sys.argv = ['xx', '-f', dbfile, '-i', 'https://invalid']
+            self.assertRaises(SystemExit, lambda: main())
+            sys.argv = ['xx', '-f', dbfile, '-a', '[New] command']
+            self.assertRaises(SystemExit, lambda: main())
+            sys.argv = ['xx', '-f', dbfile, '-a', '[New] command']
+            self.assertRaises(SystemExit, lambda: main())
+            os.unlink(dbfile)
 
     def test_sorting(self):
         xx = self.get_xx()
@@ -456,8 +1283,36 @@ class CmdManagerTests(unittest.TestCase):
         xx.ui.input.set_value('New Command')
         xx.update_selected_command()
         self.assertEqual(xx.database[0].cmd, 'New Command')
+        # Duplicate detection follows the edits
+        xx.save_disabled = True
+        self.assertTrue(xx.add_database_entry('[My Label] My command'))
+        self.assertFalse(xx.add_database_entry('[New Label] New Command'))
+        xx.delete_database_entry(DBItem('[New Label] New Command'))
+        self.assertTrue(xx.add_database_entry('[New Label] New Command'))
+
+        os.unlink(xx.filename)
 
+    def test_edit_into_duplicate(self):
+        xx = self.get_xx()
+        xx.filename = tempfile.mktemp()
+        xx.load_data(['[a] one', '[b] two'], False)
+        xx.update_search()
+        xx.selected_row = 1
+        xx.ui.input.set_value('a')
+        xx.update_selected_label()
+        self.assertEqual(xx.database[1].label, 'a')
+        # Editing an item into a copy of another is refused
+        xx.selected_row = 1
+        xx.ui.input.set_value('one')
+        xx.update_selected_command()
+        self.assertEqual(xx.database[1].cmd, 'two')
+        # So both can still be deleted
+        xx.delete_database_entry(xx.database[0])
+        xx.delete_database_entry(xx.database[0])
+        self.assertEqual(xx.database, [])
+        self.assertEqual(xx.get_file_contents(xx.filename), [])
         os.unlink(xx.filename)
+        os.unlink(xx.filename + '.lock')
 
     def test_flash(self):
         xx = self.get_xx()
@@ -45,13 +45,49 @@ class DbItemTests(unittest.TestCase):
         self.assertEqual(item.label, 'Echo It')
         self.assertEqual(item.cmd, '')
 
+        # Brackets inside a trailing label
+        item = DBItem('echo [a] b [c]')
+        self.assertEqual(item.label, 'c')
+        self.assertEqual(item.cmd, 'echo')
+
+        # Brackets inside a leading label
+        item = DBItem('[a] b [c] d')
+        self.assertEqual(item.label, 'a] b [c')
+        self.assertEqual(item.cmd, 'd')
+
+        # Empty label
+        self.assertEqual(DBItem.parse('ls []'), ('', 'ls '))
+
+        # Multiple lines are never labelled
+        item = DBItem('[a]\nb [c]')
+        self.assertEqual(item.label, '')
+        self.assertEqual(item.cmd, '[a]\nb [c]')
+
     def test_tags(self):
 
         item = DBItem('[Foo] bar')
-        self.assertIsInstance(item.tags, list)
+        self.assertIsInstance(item.tags, frozenset)
         self.assertTrue(len(item.tags) == 0)
 
         item = DBItem('[Foo] bar', ['footag', 'bartag'])
-        self.assertIsInstance(item.tags, list)
+        self.assertIsInstance(item.tags, frozenset)
         self.assertTrue(len(item.tags) == 2)
         self.assertTrue('bartag' in item.tags)
+
+        # Tag sets are shared between items
+        other = DBItem('[Bar] foo', ['bartag', 'footag'])
+        self.assertIs(item.tags, other.tags)
+        other.add_tags(['new'])
+        self.assertTrue('new' in other.tags)
+        self.assertFalse('new' in item.tags)
+
+    def test_edit_keys(self):
+        item = DBItem('[My Label] Some Command')
+        self.assertEqual(item.label_lower, 'my label')
+        self.assertEqual(item.cmd_lower, 'some command')
+        item.label = 'Other'
+        item.cmd = 'LS'
+        self.assertEqual(item.label_lower, 'other')
+        self.assertEqual(item.cmd_lower, 'ls')
+        self.assertEqual(item.search_key(), 'other ls')
+        self.assertFalse(hasattr(item, '__dict__'))
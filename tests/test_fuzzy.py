@@ -0,0 +1,68 @@
+import unittest
+from xxcmd.dbitem import DBItem
+from xxcmd.fuzzy import FuzzyMatcher
+
+
+class FuzzyTests(unittest.TestCase):
+
+    def test_match(self):
+        matcher = FuzzyMatcher('dkp')
+        self.assertEqual(matcher.match('docker ps'), 8)
+        self.assertEqual(matcher.match('docker kill ps'), 13)
+        self.assertIsNone(matcher.match('docker'))
+        self.assertIsNone(matcher.match('pkd'))
+        self.assertIsNone(matcher.match(''))
+        # Special characters are matched literally
+        matcher = FuzzyMatcher('a.]^-\\')
+        self.assertIsNotNone(matcher.match('a x.y] ^z- \\'))
+        self.assertIsNone(matcher.match('abcdef'))
+
+    def test_match_item(self):
+        matcher = FuzzyMatcher('gst')
+        item = DBItem('[Git Status] ls')
+        self.assertTrue(matcher.match_item(item, labels=True))
+        self.assertFalse(matcher.match_item(item, commands=True))
+        item = DBItem('git status')
+        self.assertFalse(matcher.match_item(item, labels=True))
+        self.assertTrue(matcher.match_item(item, True, True))
+
+    def test_score(self):
+        matcher = FuzzyMatcher('gs')
+        # Word boundaries and consecutive matches score higher
+        self.assertGreater(matcher.score('git status'), matcher.score('logs'))
+        self.assertGreater(matcher.score('gs'), matcher.score('git status'))
+        self.assertGreater(
+            matcher.score('git status'), matcher.score('git  long status'))
+        # The shortest match is scored
+        self.assertEqual(matcher.score('g g status'), matcher.score('g status'))
+        self.assertIsNone(matcher.score('sg'))
+
+    def test_rank(self):
+        items = [DBItem(x) for x in [
+            '[List] ls -al',
+            '[Logs] tail -f /var/log/syslog',
+            '[Git Status] git status',
+            '[Stuff] grep -s x',
+            '[Processes] ps aux',
+        ]]
+        matcher = FuzzyMatcher('gs')
+        self.assertEqual(
+            [x.label for x in matcher.filter(items, True, False)],
+            ['Logs', 'Git Status'])
+        self.assertEqual(
+            [x.label for x in matcher.filter(items, True, True)],
+            ['Logs', 'Git Status', 'Stuff'])
+        ranked = matcher.rank(items, True, True)
+        self.assertEqual(
+            [x.label for x in ranked], ['Git Status', 'Logs', 'Stuff'])
+        # Label matches beat command matches
+        self.assertGreater(
+            matcher.score_item(items[1], True, True),
+            matcher.score_item(items[3], True, True))
+        # Only the best few
+        self.assertEqual(matcher.rank(items, True, True, 2), ranked[:2])
+        self.assertEqual(matcher.rank(items, True, True, 10), ranked)
+        # Equal matches keep their order
+        items = [DBItem('[Abc{0}] x'.format(i)) for i in range(5)]
+        matcher = FuzzyMatcher('ac')
+        self.assertEqual(matcher.rank(items, True, False, 3), items[:3])
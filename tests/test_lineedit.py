@@ -97,3 +97,45 @@ class LineEditTests(unittest.TestCase):
         edit.right(LineEdit.WORD)
         edit.addchar('X')
         self.assertEqual(str(edit), 'one two YXthree    four Xfive    X')
+
+    def test_insert(self):
+        edit = LineEdit()
+        edit.set_value('git  -n 5')
+        edit.left(LineEdit.LINE)
+        edit.right()
+        edit.right()
+        edit.right()
+        edit.right()
+        edit.insert('log')
+        self.assertEqual(edit.value, 'git log -n 5')
+        self.assertEqual(edit.cursor, 7)
+        edit.insert('')
+        edit.insert(' --oneline')
+        self.assertEqual(str(edit), 'git log --oneline -n 5')
+        edit.left(LineEdit.LINE)
+        edit.delchar()
+        self.assertEqual(str(edit), 'git log --oneline -n 5')
+        edit.right(LineEdit.LINE)
+        edit.delchar()
+        self.assertEqual(str(edit), 'git log --oneline -n ')
+        self.assertEqual(edit.cursor, 21)
+
+    def test_cached_value(self):
+        edit = LineEdit()
+        edit.set_value('ls')
+        # Typing and deleting at the end keep the value without rebuilding it
+        for char in ' -la':
+            edit.addchar(char)
+        edit.delchar()
+        self.assertEqual(edit._linetext, 'ls -l')
+        self.assertEqual(edit.value, 'ls -l')
+        # Edits elsewhere rebuild it when it's next needed
+        edit.left()
+        edit.addchar('-')
+        self.assertIsNone(edit._linetext)
+        self.assertEqual(edit.value, 'ls --l')
+        edit.right()
+        edit.delchar()
+        self.assertEqual(edit.value, 'ls --')
+        edit.addchar('a')
+        self.assertEqual(edit._linetext, 'ls --a')
@@ -0,0 +1,50 @@
+import random
+import unittest
+from xxcmd import resultview, DBItem
+from xxcmd.resultview import ResultView
+
+
+class ResultViewTests(unittest.TestCase):
+
+    def test_unsorted(self):
+        items = [3, 1, 2]
+        view = ResultView(items)
+        self.assertEqual(len(view), 3)
+        self.assertEqual(view[0], 3)
+        self.assertEqual(view[-1], 2)
+        self.assertEqual(view[1:], [1, 2])
+        self.assertEqual(view, [3, 1, 2])
+        self.assertIs(view.unordered(), items)
+        self.assertRaises(IndexError, lambda: view[3])
+        self.assertFalse(ResultView())
+        self.assertEqual(ResultView(), [])
+
+    def test_lazy_sort(self):
+        random.seed(1)
+        items = [(random.randint(0, 50), i) for i in range(2000)]
+        # Ties keep their original order
+        expected = sorted(items, key=lambda x: x[0])
+
+        view = ResultView(items, key=lambda x: x[0])
+        self.assertEqual(view[0], expected[0])
+        self.assertEqual(len(view._sorted), resultview.MIN_SORTED)
+        self.assertEqual(view[9], expected[9])
+        self.assertEqual(view[:20], expected[:20])
+        # Scrolling sorts more
+        self.assertEqual(view[100], expected[100])
+        self.assertEqual(len(view._sorted), 2 * resultview.MIN_SORTED)
+        self.assertEqual(list(view), expected)
+        self.assertEqual(view[-1], expected[-1])
+        self.assertRaises(IndexError, lambda: view[2000])
+
+        # Asking for everything at once
+        view = ResultView(items, key=lambda x: x[0])
+        self.assertEqual(view[-1], expected[-1])
+        self.assertEqual(view, expected)
+        self.assertEqual(view.unordered(), items)
+
+    def test_label_width(self):
+        items = [DBItem('[a] one'), DBItem('[abc] two'), DBItem('three')]
+        self.assertEqual(ResultView(items).label_width(), 3)
+        self.assertEqual(ResultView(items, label_width=8).label_width(), 8)
+        self.assertEqual(ResultView().label_width(), 0)
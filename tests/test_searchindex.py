@@ -0,0 +1,39 @@
+import unittest
+from xxcmd import DBItem
+from xxcmd.searchindex import TrigramIndex, trigrams
+
+
+class SearchIndexTests(unittest.TestCase):
+
+    def test_trigrams(self):
+        self.assertEqual(trigrams('abcd'), {'abc', 'bcd'})
+        self.assertEqual(trigrams('ab'), set())
+
+    def test_candidates(self):
+        one = DBItem('[Show Processes] top')
+        two = DBItem('[Disk Usage] du -h .')
+        three = DBItem('[Processor] cat /proc/cpuinfo')
+        index = TrigramIndex([one, two, three])
+        self.assertEqual(len(index), 3)
+
+        # Too short to use the index
+        self.assertIsNone(index.candidates('pr', True, True))
+
+        # Candidates keep their order
+        self.assertEqual(index.candidates('proc', True), [one, three])
+        self.assertEqual(index.candidates('proc', False, True), [three])
+        self.assertEqual(index.candidates('proc', True, True), [one, three])
+        self.assertEqual(index.candidates('zzz', True, True), [])
+
+        # Edits
+        index.discard(one)
+        one.label = 'Top'
+        index.add(one)
+        self.assertEqual(index.candidates('proc', True), [three])
+        self.assertEqual(index.candidates('top', True), [one])
+
+        # Removal
+        index.remove(three)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(index.candidates('proc', True, True), [])
+        self.assertFalse(index.labels.get('pro'))
@@ -0,0 +1,50 @@
+import unittest
+from xxcmd.dbitem import DBItem
+from xxcmd.sorteditems import SortedItems
+
+
+class SortedItemsTests(unittest.TestCase):
+
+    def test_sorted_items(self):
+        items = [DBItem(x) for x in [
+            '[b] one', '[A] two', '[c] three', '[a] four', '[B] five']]
+        sortitems = SortedItems(items, 'label')
+        self.assertEqual(
+            [x.cmd for x in sortitems.items],
+            ['two', 'five', 'four', 'one', 'three'])
+        # Equal items keep their order
+        sortitems = SortedItems(items, 'label_lower')
+        self.assertEqual(
+            [x.cmd for x in sortitems.items],
+            ['two', 'four', 'one', 'five', 'three'])
+        sortitems.add(DBItem('[a] six'))
+        sortitems.add(DBItem('[0] seven'))
+        sortitems.add(DBItem('[z] eight'))
+        self.assertEqual(
+            [x.cmd for x in sortitems.items],
+            ['seven', 'two', 'four', 'six', 'one', 'five', 'three', 'eight'])
+        self.assertEqual(sortitems.keys, sorted(sortitems.keys))
+
+        # Items are found by identity
+        self.assertIsNone(sortitems.remove(DBItem('[a] four')))
+        self.assertEqual(sortitems.remove(items[3]), 3)
+        self.assertIsNone(sortitems.remove(items[3]))
+        # Or by their old key
+        items[0].label = 'Y'
+        self.assertEqual(sortitems.remove(items[0], 'b'), 0)
+        sortitems.add(items[0])
+        self.assertEqual(
+            [x.cmd for x in sortitems.items],
+            ['seven', 'two', 'six', 'five', 'three', 'one', 'eight'])
+        self.assertEqual(len(sortitems.keys), len(sortitems.items))
+
+        # Changed items added back with their order keep their place
+        # amongst equal items
+        items[4].label = 'a'
+        order = sortitems.remove(items[4], 'b')
+        sortitems.add(items[4], order)
+        items[0].label = 'a'
+        sortitems.add(items[0], sortitems.remove(items[0], 'y'))
+        self.assertEqual(
+            [x.cmd for x in sortitems.items],
+            ['seven', 'two', 'five', 'six', 'one', 'three', 'eight'])
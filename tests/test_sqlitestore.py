@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from xxcmd import DBItem
+from xxcmd.sqlitestore import SQLiteStore
+
+
+class SQLiteStoreTests(unittest.TestCase):
+
+    def get_store(self):
+        store = SQLiteStore(':memory:')
+        store.add([
+            DBItem('[Show Processes] top'),
+            DBItem('[disk usage] du -h .'),
+            DBItem('ps aux [Processor]'),
+            DBItem('cat /proc/cpuinfo')])
+        return store
+
+    def test_add(self):
+        store = self.get_store()
+        self.assertEqual(len(store), 4)
+        store.add([DBItem('[Show Processes] top')])
+        self.assertEqual(len(store), 4)
+        items = store.load()
+        self.assertEqual(items[0].label, 'Show Processes')
+        self.assertEqual(items[3].cmd, 'cat /proc/cpuinfo')
+
+    def test_readonly(self):
+        filename = tempfile.mktemp()
+        store = SQLiteStore(filename)
+        store.add([DBItem('[Show Processes] top')])
+        store.close()
+        store = SQLiteStore(filename, readonly=True)
+        self.assertEqual([x.cmd for x in store.iter_items()], ['top'])
+        self.assertRaises(
+            sqlite3.OperationalError, store.add, [DBItem('ls')])
+        store.close()
+        os.unlink(filename)
+
+    def test_search(self):
+        store = self.get_store()
+        for fts in (True, False):
+            store.fts = fts and store.fts
+            self.assertEqual(
+                [x.cmd for x in store.search('proc', True)],
+                ['top', 'ps aux'])
+            self.assertEqual(
+                [x.cmd for x in store.search('proc', False, True)],
+                ['cat /proc/cpuinfo'])
+            self.assertEqual(
+                [x.cmd for x in store.search('proc', True, True, 'cmd')],
+                ['cat /proc/cpuinfo', 'ps aux', 'top'])
+            self.assertEqual(
+                [x.label for x in store.search('s', True, False, 'label')],
+                ['Processor', 'Show Processes', 'disk usage'])
+            self.assertEqual(
+                [x.label for x in store.search('s', True, False, 'label_lower')],
+                ['disk usage', 'Processor', 'Show Processes'])
+            self.assertEqual(store.search('"x', True, True), [])
+
+    def test_changes(self):
+        store = self.get_store()
+        items = store.load()
+        items[0].label = 'Top'
+        store.update(('top', 'Show Processes'), items[0])
+        self.assertEqual(
+            [x.label for x in store.search('proc', True)], ['Processor'])
+        self.assertEqual(store.search('top', True), [items[0]])
+        store.remove([('ps aux', 'Processor')])
+        self.assertEqual(store.search('proc', True), [])
+        self.assertEqual(len(store), 3)
+        # Editing into a duplicate
+        items[1].label = ''
+        items[1].cmd = 'cat /proc/cpuinfo'
+        store.update(('du -h .', 'disk usage'), items[1])
+        self.assertEqual(len(store), 2)
+        self.assertEqual([x.cmd for x in store.iter_items()], ['top', 'cat /proc/cpuinfo'])
@@ -0,0 +1,30 @@
+import os
+import sys
+import subprocess
+import unittest
+
+
+class StartupTests(unittest.TestCase):
+
+    # Modules which are slow to import and not needed by every code path
+    LAZY_MODULES = (
+        'subprocess', 'urllib.request', 'curses', 'argparse', 'configparser')
+    # Pythons before 3.7 look up our git version, with subprocess, as
+    # we're imported
+    if sys.version_info < (3, 7):
+        LAZY_MODULES = LAZY_MODULES[1:]
+
+    def test_lazy_imports(self):
+        code = (
+            "import sys, xxcmd\n"
+            "print(' '.join(x for x in {0!r} if x in sys.modules))".format(
+                self.LAZY_MODULES))
+        result = subprocess.check_output(
+            [sys.executable, '-c', code],
+            cwd=os.path.join(os.path.dirname(__file__), os.pardir))
+        self.assertEqual(result.decode('utf-8').strip(), '')
+
+    def test_dev_version(self):
+        import xxcmd
+        self.assertIsInstance(xxcmd.dev_version(), str)
+        self.assertEqual(xxcmd.__dev_version__, xxcmd.dev_version())
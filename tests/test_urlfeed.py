@@ -0,0 +1,218 @@
+import os
+import shutil
+import tempfile
+import time
+import threading
+import unittest
+from unittest.mock import patch
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from .test_cmdmanager import captured_output
+from xxcmd import CmdManager, urlfeed
+from xxcmd.urlfeed import UrlFeed
+
+
+# Serves a single feed, supporting conditional requests by ETag
+class FeedHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        if server.delay:
+            # Stall until the client gives up
+            time.sleep(server.delay)
+            return
+        if self.path != '/feed':
+            self.send_error(404)
+            return
+        server.requests.append(self.headers.get('If-None-Match'))
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body = server.body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FeedServer(HTTPServer):
+
+    def __init__(self, body, etag='"1"'):
+        super().__init__(('127.0.0.1', 0), FeedHandler)
+        self.body = body
+        self.etag = etag
+        self.delay = 0
+        self.requests = []
+        self.url = 'http://127.0.0.1:{0}/feed'.format(self.server_port)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class UrlFeedTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def get_xx(self):
+        xx = CmdManager()
+        xx.filename = tempfile.mktemp()
+        xx.cachedir = self.cachedir
+        xx.config.load_global_database = False
+        return xx
+
+    def test_iter_lines(self):
+        data = "[Ünïcode] ls ✓\r\n\r\n  [Two] ps  \rthree\n\rfour".encode('utf-8')
+        # Every chunk size splits line endings and characters differently
+        for size in range(1, 8):
+            with patch.object(urlfeed, 'CHUNK_SIZE', size):
+                with tempfile.NamedTemporaryFile() as datafile:
+                    datafile.write(data)
+                    datafile.flush()
+                    feed = UrlFeed('file://' + datafile.name)
+                    with feed.open() as stream:
+                        lines = list(feed.iter_lines(stream))
+                self.assertEqual(
+                    lines, ["[Ünïcode] ls ✓", "[Two] ps", "three", "four"])
+                self.assertEqual(feed.stats.bytes, len(data))
+                self.assertEqual(feed.stats.lines, 4)
+
+    def test_conditional_import(self):
+        xx = self.get_xx()
+        with FeedServer("[One] ls\n[Two] ps\n") as server:
+            stats = xx.import_database_url(server.url)
+            self.assertFalse(stats.not_modified)
+            self.assertEqual((stats.added, stats.duplicates), (2, 0))
+            self.assertEqual((stats.bytes, stats.lines), (18, 2))
+
+            # Unchanged feeds are merged from our cache
+            stats = xx.import_database_url(server.url)
+            self.assertTrue(stats.not_modified)
+            self.assertEqual((stats.added, stats.duplicates), (0, 2))
+            self.assertEqual(stats.bytes, 0)
+            self.assertEqual(server.requests, [None, '"1"'])
+
+            # Changed feeds are downloaded again
+            server.body += "[Three] top\n"
+            server.etag = '"2"'
+            stats = xx.import_database_url(server.url)
+            self.assertFalse(stats.not_modified)
+            self.assertEqual((stats.added, stats.duplicates), (1, 2))
+
+            # Without a cache we always download the feed
+            xx.config.cache_databases = False
+            stats = xx.import_database_url(server.url)
+            self.assertFalse(stats.not_modified)
+            self.assertEqual(server.requests[-1], None)
+        self.assertEqual(
+            [x.label for x in xx.database], ['One', 'Two', 'Three'])
+        self.assertEqual(len(xx.get_file_contents(xx.filename)), 3)
+        os.unlink(xx.filename)
+
+    def test_failed_import(self):
+        xx = self.get_xx()
+        with FeedServer("") as server:
+            with captured_output() as (out, err):
+                self.assertFalse(xx.import_database_url(server.url + '/missing'))
+        self.assertEqual(xx.database, [])
+
+    def test_multiple_imports(self):
+        xx = self.get_xx()
+        xx.config.import_timeout = 0.5
+        with tempfile.NamedTemporaryFile() as datafile:
+            datafile.write(b"[Three] top\n[One] ls\n")
+            datafile.flush()
+            with FeedServer("[One] ls\n[Two] ps\n") as first, \
+                    FeedServer("[Four] df\n", '"4"') as second, \
+                    FeedServer("[Slow] sleep 1\n") as slow:
+                # Slow feeds time out without holding up the others
+                slow.delay = 2
+                start = time.monotonic()
+                with captured_output() as (out, err):
+                    results = xx.import_database_urls([
+                        first.url, slow.url, 'file://' + datafile.name,
+                        first.url + '/missing', second.url])
+                self.assertLess(time.monotonic() - start, 1.5)
+                self.assertIn('timed out', out.getvalue())
+        self.assertFalse(results[1])
+        self.assertFalse(results[3])
+        self.assertEqual(
+            [(x.added, x.duplicates) for x in results if x],
+            [(2, 0), (1, 1), (1, 0)])
+        # Feeds are merged in the order given, and saved together
+        self.assertEqual(
+            [x.label for x in xx.database], ['One', 'Two', 'Three', 'Four'])
+        self.assertEqual(
+            xx.get_file_contents(xx.filename),
+            ['ls [One]', 'ps [Two]', 'top [Three]', 'df [Four]'])
+        os.unlink(xx.filename)
+
+    def test_subscriptions(self):
+        def refresh(xx, urls=None):
+            xx.refresh_subscriptions(urls)
+            for feed, thread in xx._refreshing:
+                thread.join()
+            return xx.update_subscriptions()
+
+        with FeedServer("[One] ls\n[Two] ps\n") as server:
+            xx = self.get_xx()
+            xx.config.subscriptions = server.url
+            xx.add_database_entry('[Two] ps')
+            # Nothing cached yet
+            self.assertTrue(xx.load_databases())
+            self.assertEqual([x.label for x in xx.database], ['Two'])
+            self.assertEqual(xx._stale_subscriptions, [server.url])
+            self.assertTrue(refresh(xx))
+            self.assertEqual([x.label for x in xx.database], ['Two', 'One'])
+            # Our own copy stays editable, and feeds are never saved
+            self.assertFalse(xx.is_readonly(xx.database[0]))
+            self.assertTrue(xx.is_subscribed(xx.database[1]))
+            self.assertEqual(len(xx.get_file_contents(xx.filename)), 1)
+
+            # Fresh caches are used without downloading
+            other = self.get_xx()
+            other.filename = xx.filename
+            other.config.subscriptions = server.url
+            other.load_databases()
+            self.assertEqual([x.label for x in other.database], ['Two', 'One'])
+            self.assertEqual(other._stale_subscriptions, [])
+            self.assertEqual(
+                [x.label for x in other.iter_database()], ['Two', 'One'])
+
+            # Stale caches are checked, unchanged feeds change nothing
+            other.config.subscription_ttl = 0
+            other.load_databases()
+            self.assertFalse(refresh(other))
+            self.assertEqual(server.requests, [None, '"1"'])
+
+            # Changed feeds are swapped in, but not whilst editing
+            server.body = "[Three] top\n"
+            server.etag = '"2"'
+            other.edit_newcmd_mode()
+            self.assertFalse(refresh(other, [server.url]))
+            other.search_mode()
+            self.assertTrue(other.update_subscriptions())
+            self.assertEqual(
+                [x.label for x in other.database], ['Two', 'Three'])
+
+        # Subscribed items can't be changed
+        other.selected_row = 0
+        self.assertEqual(other.selected_item.label, 'Three')
+        other.ui.input.set_value('Four')
+        other.update_selected_label()
+        other.delete_selected_database_entry()
+        self.assertEqual([x.label for x in other.database], ['Two', 'Three'])
+        self.assertEqual(len(other.get_file_contents(xx.filename)), 1)
+        os.unlink(xx.filename)
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+from xxcmd import usage
+from xxcmd.dbitem import DBItem
+from xxcmd.usage import UsageStore
+
+
+class UsageTests(unittest.TestCase):
+
+    def setUp(self):
+        self.filename = tempfile.mktemp()
+
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    def test_record_and_load(self):
+        store = UsageStore(self.filename)
+        self.assertFalse(store.load())
+        one = DBItem('[One] ls -al')
+        two = DBItem('echo [two]')
+        store.record(one, 100)
+        store.record(one, 200)
+        store.record(two, 150)
+        store.record(DBItem('[Bad] ['), 150)
+        with open(self.filename, 'a') as f:
+            f.write("junk\n")
+            f.write("200 oops ps [P]\n")
+            f.write("200 -1 ps [P]\n")
+
+        store = UsageStore(self.filename)
+        self.assertTrue(store.load())
+        self.assertEqual(store.stats[('ls -al', 'One')], (2, 200))
+        self.assertEqual(store.stats[('echo', 'two')], (1, 150))
+        self.assertEqual(store.frecency(DBItem('top'), 200), 0)
+
+    def test_frecency(self):
+        store = UsageStore(self.filename)
+        item = DBItem('[One] ls')
+        store.record(item, 0)
+        store.record(item, 0)
+        self.assertEqual(store.frecency(item, 60), 8)
+        self.assertEqual(store.frecency(item, usage.HOUR), 4)
+        self.assertEqual(store.frecency(item, usage.DAY), 1)
+        self.assertEqual(store.frecency(item, usage.WEEK), 0.5)
+
+    def test_compact(self):
+        store = UsageStore(self.filename)
+        items = [DBItem('[Cmd {0}] cmd {0}'.format(i)) for i in range(3)]
+        for i in range(usage.COMPACT_SLACK + 10):
+            store.record(items[i % 3], i)
+        with open(self.filename) as f:
+            self.assertEqual(len(f.readlines()), usage.COMPACT_SLACK + 10)
+
+        store = UsageStore(self.filename)
+        store.load()
+        stats = dict(store.stats)
+        with open(self.filename) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        store = UsageStore(self.filename)
+        store.load()
+        self.assertEqual(store.stats, stats)
+        self.assertEqual(
+            stats[('cmd 0', 'Cmd 0')], (37, usage.COMPACT_SLACK + 8))
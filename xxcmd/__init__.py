@@ -1,22 +1,21 @@
 """A helper for remembering useful shell commands."""
-import os
-from subprocess import check_output, CalledProcessError
+import sys
 from .cmdmanager import CmdManager
 from .dbitem import DBItem
-from .main import main, __version__
+from .main import main, dev_version, __version__
 
 
-# Inspect git version if we're in a git repo
-__dev_version__ = ''
-thisdir = os.path.dirname(os.path.realpath(__file__))
-if os.path.isdir(os.path.join(thisdir, os.pardir, '.git')):
-    try:
-        ver = check_output('git describe --tags'.split())
-    except CalledProcessError:
-        ver = ''  # don't care
-    if ver:
-        ver = ver.decode('utf-8').strip()
-        __dev_version__ = ver
+# Looking up our git version is slow, only do it when asked. Pythons
+# before 3.7 can't look up module attributes lazily, so there it's a
+# plain attribute as it always was.
+if sys.version_info < (3, 7):
+    __dev_version__ = dev_version()
+else:
+    def __getattr__(name):
+        if name == '__dev_version__':
+            return dev_version()
+        raise AttributeError(
+            "module {0!r} has no attribute {1!r}".format(__name__, name))
 
 
-__all__ = ('DBItem', 'CmdManager', 'main', '__version__', '__dev_version__')
+__all__ = ('DBItem', 'CmdManager', 'main', 'dev_version', '__version__')
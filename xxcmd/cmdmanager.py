@@ -1,10 +1,20 @@
 # cmdmanager.py
 import os
-import subprocess
-import urllib.request
+import mmap
+import time
+from operator import attrgetter
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 from .dbitem import DBItem
 from .consoleui import ConsoleUI
 from .config import Config
+from .dbcache import DatabaseCache
+from .searchindex import TrigramIndex
+from .resultview import ResultView
+from .sorteditems import SortedItems
 
 
 # Where is the system-wide database of commands?
@@ -13,6 +23,16 @@ DEFAULT_SYSTEM_DATABASE_FILE = '/etc/xxcmd'
 # Where do we store our database of commands?
 DEFAULT_DATABASE_FILE = "~/.xxcmd"
 
+# Where do we store our database of commands with the SQLite backend?
+DEFAULT_SQLITE_DATABASE_FILE = "~/.xxcmd.db"
+
+# Database files with these extensions use the SQLite backend
+SQLITE_EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+# Where do we cache parsed databases?
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', '~/.cache'), 'xxcmd')
+
 # What shell do we use to execute commands?
 if 'SHELL' in os.environ:
     DEFAULT_SHELL = os.environ['SHELL']
@@ -27,6 +47,22 @@ DEFAULT_COMMANDS = [
 ]
 
 
+# How many changes can the journal hold before we rewrite the database?
+JOURNAL_COMPACT_THRESHOLD = 100
+
+# How many earlier search results do we keep for narrowing searches?
+SEARCH_STACK_SIZE = 32
+
+# How many URLs do we download at the same time when importing?
+IMPORT_THREADS = 8
+
+# Items we search between checks on how long we've been searching
+SEARCH_CHUNK_SIZE = 2000
+
+# Seconds we search for before checking for key presses again
+SEARCH_SLICE = 0.05
+
+
 class UnitTestException(Exception):
     pass
 
@@ -49,6 +85,8 @@ class CmdManager():
     # selected_item - dbitem instance at selected row
     @property
     def selected_item(self):
+        # Acting on a result means the user has settled on their search
+        self.finish_search()
         idx = self.selected_row
         if self.results and idx >= 0 and idx < len(self.results):
             return self.results[idx]
@@ -63,27 +101,67 @@ class CmdManager():
         self.config = Config()
         # Our cmd database
         self.database = []
+        # Index of our database by (cmd, label) for quick duplicate checks
+        self._item_keys = {}
+        # Number of labels in our database of each length
+        self._label_widths = {}
         # Flag for if the file even exists
         self.database_exists = True
         # Our UI
         self.ui = ConsoleUI(self)
         # Our current search results
-        self.results = []
+        self.results = ResultView()
+        # Optional trigram index of our database
+        self._search_index = None
+        # Our database in sort order, built when we first search
+        self._sorted = None
+        # Items which aren't in our SQLite store
+        self._unstored = None
+        # Recent search results we can narrow down as the user types
+        self._search_stack = []
+        # Search in slices between key presses, rather than all at once
+        self.background_search = False
+        # The search we're part way through, if any
+        self._searching = None
+        self._search_options = None
         # Our current selection row
         self._selected_row = 0
         # Our default data filename
         self.filename = DEFAULT_DATABASE_FILE
+        if self.config.database_backend == 'sqlite':
+            self.filename = DEFAULT_SQLITE_DATABASE_FILE
+        # Our SQLite database, if we're using one
+        self.store = None
         # Our default system data filename
         self.sysfilename = DEFAULT_SYSTEM_DATABASE_FILE
+        # Where we cache parsed databases
+        self.cachedir = DEFAULT_CACHE_DIR
         # The shell we'll use to execute commands
         self.shell = DEFAULT_SHELL
         if self.config.shell.lower() != 'default':
             self.shell = self.config.shell
-        # Default mode
-        self._mode = ''
-        self.search_mode()
         # Saving disabled?
         self.save_disabled = False
+        # Number of changes in our journal file
+        self._journal_records = 0
+        # What we last saw of the user database on disk, as (filename,
+        # file states, set of (cmd, label) keys)
+        self._disk_state = None
+        # Our lock on the user database
+        self._lock_file = None
+        self._lock_depth = 0
+        # Items we loaded from each subscribed feed
+        self._subscribed = {}
+        # Subscribed feeds which need downloading again
+        self._stale_subscriptions = []
+        # Subscribed feeds we are downloading in the background, as
+        # (feed, thread)
+        self._refreshing = []
+        # Our record of which commands are run, loaded when needed
+        self._usage = None
+        # Default mode, last as searching needs the rest of our state
+        self._mode = ''
+        self.search_mode()
 
     # Get contents of file, return a list of lines
     def get_file_contents(self, filename):
@@ -93,46 +171,185 @@ class CmdManager():
         # Return file contents
         # Allow exceptions to raise here, if we can't read this
         # something is horribly wrong
-        f = open(filename, "rt")
-        lines = [x.strip() for x in f.readlines()]
-        f.close()
-        return lines
+        return list(self.iter_file_lines(filename))
 
-    # Get URL contents
-    def get_url_contents(self, url):
+    # Lazily read the stripped lines of a file through a memory map,
+    # so we never hold more than one line of a big file in memory
+    def iter_file_lines(self, filename):
+        filename = os.path.expanduser(filename)
+        with open(filename, "rb") as infile:
+            size = os.fstat(infile.fileno()).st_size
+            # Empty files can't be mapped
+            if not size:
+                return
+            with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                start = 0
+                while start < size:
+                    end = data.find(b'\n', start)
+                    if end < 0:
+                        end = size
+                    line = data[start:end]
+                    start = end + 1
+                    # Support any style of line endings
+                    if line.endswith(b'\r'):
+                        line = line[:-1]
+                    if b'\r' in line:
+                        for part in line.split(b'\r'):
+                            yield part.decode('utf-8').strip()
+                    else:
+                        yield line.decode('utf-8').strip()
+
+    # Get the items in a database file, return a list of DBItems
+    def get_file_items(self, filename):
+        if not os.path.isfile(os.path.expanduser(filename)):
+            return False
+        return list(self.iter_file_items(filename))
+
+    # Lazily get the items in a database file
+    def iter_file_items(self, filename):
+        cache = None
+        if self.config.cache_databases and self.cachedir:
+            cache = DatabaseCache(self.cachedir)
+            items = cache.load(filename)
+            if items is not None:
+                yield from items
+                return
 
-        if url.startswith('file://'):
-            # fake it for testing
-            resp = "\n".join(
-                self.get_file_contents(url[7:])).encode('utf-8')
-        else:
-            # Load data from an actual URL
-            try:
-                resp = urllib.request.urlopen(url).read()
-            except Exception as ex:
-                print("Could not retrieve url: {0}".format(ex))
-                return False
+        # Remember the file state before we read it
+        try:
+            stat = os.stat(os.path.expanduser(filename))
+        except OSError:
+            return
+        # Only keep the items if we're going to cache them
+        items = [] if cache else None
+        for line in self.iter_file_lines(filename):
+            if line:
+                item = DBItem(line)
+                if cache:
+                    items.append(item)
+                yield item
+        # We read the whole file, so we can cache it
+        if cache:
+            cache.save(filename, items, stat)
+
+    # Lazily iterate the items in our default databases without loading
+    # them into our database, duplicates are skipped
+    def iter_database(self):
+        sources = []
+        if self.config.load_global_database:
+            sources.append(self.iter_tagged_items(self.sysfilename, ['global']))
+        sources.append(self.iter_user_items())
+        sources.append(self.iter_subscribed_items())
+
+        seen = set()
+        for items in sources:
+            for item in items:
+                key = self._item_key(item)
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield item
+
+    # Lazily iterate the items in a database file, adding some tags
+    def iter_tagged_items(self, filename, tags):
+        for item in self.iter_file_items(filename):
+            item.add_tags(tags)
+            yield item
+
+    # Lazily iterate the items in the user database, including any
+    # changes in our journal
+    def iter_user_items(self):
+        if self.use_sqlite():
+            filename = os.path.expanduser(self.filename)
+            if os.path.isfile(filename):
+                from .sqlitestore import SQLiteStore
+                store = SQLiteStore(filename, readonly=True)
+                try:
+                    yield from store.iter_items()
+                finally:
+                    store.close()
+            # A new default database starts from the text one, as in
+            # load_store()
+            elif self.filename == DEFAULT_SQLITE_DATABASE_FILE:
+                yield from self.iter_file_items(DEFAULT_DATABASE_FILE)
+            return
 
-        # Get data
-        lines = resp.decode('utf-8')
-        if '\r\n' in lines:
-            lines = lines.split("\r\n")
-        elif '\n\r' in lines:
-            lines = lines.split("\n\r")
-        elif '\n' in lines:
-            lines = lines.split("\n")
-        elif '\r' in lines:
-            lines = lines.split("\r")
-        lines = [x.strip() for x in lines]
-        return lines
+        # The final change to each item in the journal
+        changes = {}
+        for op, item in self.get_journal():
+            changes[self._item_key(item)] = ('-' if op == '-' else '+', item)
+
+        for item in self.iter_file_items(self.filename):
+            if changes.get(self._item_key(item), ('+',))[0] == '+':
+                yield item
+        for op, item in changes.values():
+            if op == '+':
+                yield item
+
+    # Lazily iterate the cached items of our subscribed feeds
+    def iter_subscribed_items(self):
+        urls = self.subscription_urls()
+        if not urls:
+            return
+        from .urlfeed import UrlFeed
+        for url in urls:
+            for item in UrlFeed(url, self.cachedir).load_cache() or ():
+                item.add_tags(['subscribed'])
+                yield item
 
-    def import_database_url(self, url):
-        data = self.get_url_contents(url)
-        if not data:
+    # Get the stripped lines of a URL, returns False on failure
+    def get_url_contents(self, url):
+        from .urlfeed import UrlFeed
+        feed = UrlFeed(url)
+        try:
+            with feed.open() as stream:
+                return list(feed.iter_lines(stream))
+        except Exception as ex:
+            print("Could not retrieve url: {0}".format(ex))
             return False
-        self.load_data(data, True)
-        self.save_database()
-        return True
+
+    # Import and merge a database from a URL, returns the FeedStats of
+    # the import or False on failure
+    def import_database_url(self, url):
+        return self.import_database_urls([url])[0]
+
+    # Import and merge databases from several URLs, downloading them at
+    # the same time. The feeds are merged in the order given and saved
+    # just once. Feeds which haven't changed since we last downloaded
+    # them are merged from our cache. Returns a list with the FeedStats
+    # of each import, or False for any that failed.
+    def import_database_urls(self, urls):
+        from .urlfeed import UrlFeed
+        from concurrent.futures import ThreadPoolExecutor
+        cachedir = self.config.cache_databases and self.cachedir
+        feeds = [UrlFeed(x, cachedir, self.config.import_timeout) for x in urls]
+        if not feeds:
+            return []
+        with ThreadPoolExecutor(min(len(feeds), IMPORT_THREADS)) as pool:
+            fetched = list(pool.map(self._fetch_feed, feeds))
+
+        results = []
+        added = []
+        for feed, items in zip(feeds, fetched):
+            if not items:
+                if feed.stats.error:
+                    print("Could not retrieve url: {0}".format(feed.stats.error))
+                results.append(False)
+                continue
+            new, feed.stats.duplicates = self._add_items(items)
+            feed.stats.added = len(new)
+            added.extend(new)
+            results.append(feed.stats)
+        self._items_added(added)
+        return results
+
+    # Get the items of a feed, None on failure
+    def _fetch_feed(self, feed):
+        try:
+            return feed.get_items()
+        except Exception as ex:
+            feed.stats.error = ex
+            return None
 
     # Load (optionally merge) some data into our database
     # data should be an iterable of lines
@@ -141,30 +358,30 @@ class CmdManager():
         # Start from scratch
         if not merge:
             self.database.clear()
+            self._item_keys.clear()
+            self._label_widths.clear()
+            self._search_index = None
+            self._sorted = None
+            self._database_changed()
 
         # If we aren't passed any data, bail out
         if not data:
             return
 
-        # Load each line
-        for line in data:
-            # Skip empty
-            if not line.strip():
-                continue
-            self.save_disabled = True
-            try:
-                self.add_database_entry(line, tags)
-            except Exception as ex:
-                raise ex
-            finally:
-                self.save_disabled = False
+        # Loading never writes back to the database file
+        save_disabled = self.save_disabled
+        self.save_disabled = True
+        try:
+            self.add_database_entries(data, tags)
+        finally:
+            self.save_disabled = save_disabled
 
         return True
 
     # Load a command database from a file
     def load_file(self, filename, merge=False, tags=None):
 
-        data = self.get_file_contents(filename)
+        data = self.get_file_items(filename)
         if not data:
             return data
 
@@ -172,6 +389,8 @@ class CmdManager():
 
     # Load default databases
     def load_databases(self):
+        dbname = os.path.realpath(os.path.expanduser(self.filename))
+        stamp = self._disk_stamp(dbname)
         merge = False
         globalfile = False
         # Try the system global database
@@ -180,42 +399,408 @@ class CmdManager():
             merge = True
 
         # Try the local user database
-        localfile = self.load_file(self.filename, merge)
+        if self.use_sqlite():
+            localfile = self.load_store(merge)
+        else:
+            localfile = self.load_file(self.filename, merge)
         if localfile is False:
             self.database_exists = False
+        # Apply any changes saved since
+        if self.replay_journal():
+            localfile = True
+        # Remember what we loaded, so we can merge other changes
+        self._disk_state = (dbname, stamp, set(
+            self._item_key(x) for x in self.database
+            if not self.is_readonly(x)))
+        # Subscribed feeds come last, so they never hide our own items
+        subscribed = self.load_subscriptions()
         # Return if we loaded anything at all
-        return globalfile or localfile
+        return globalfile or localfile or subscribed
+
+    # The URLs of the feeds we subscribe to
+    def subscription_urls(self):
+        urls = self.config.subscriptions
+        if type(urls) is not str:
+            return []
+        return urls.split()
+
+    # Load our subscribed feeds from our cache, remembering any which need
+    # refreshing. Returns True if we loaded any items.
+    def load_subscriptions(self):
+        urls = self.subscription_urls()
+        if not urls:
+            return False
+        from .urlfeed import UrlFeed
+        loaded = False
+        self._stale_subscriptions = []
+        for url in urls:
+            feed = UrlFeed(url, self.cachedir)
+            items = feed.load_cache()
+            if items:
+                self._merge_subscription(url, items)
+                loaded = True
+            age = feed.cache_age()
+            if age is None or age >= self.config.subscription_ttl:
+                self._stale_subscriptions.append(url)
+        return loaded
+
+    # Replace the items we have from a subscribed feed
+    def _merge_subscription(self, url, items):
+        self._remove_items(self._subscribed.pop(url, ()))
+        added, duplicates = self._add_items(items, ['subscribed'])
+        self._subscribed[url] = added
+        self.get_search_index()
+
+    # Start downloading subscribed feeds in the background
+    def refresh_subscriptions(self, urls=None):
+        from threading import Thread
+        from .urlfeed import UrlFeed
+        if urls is None:
+            urls = self._stale_subscriptions
+            self._stale_subscriptions = []
+        cachedir = self.cachedir
+        for url in urls:
+            feed = UrlFeed(url, cachedir, self.config.import_timeout)
+            # Daemon threads never hold up our exit
+            thread = Thread(target=self._fetch_feed, args=(feed,), daemon=True)
+            thread.start()
+            self._refreshing.append((feed, thread))
+
+    # Are we still downloading any subscribed feeds?
+    def refresh_pending(self):
+        return bool(self._refreshing)
+
+    # Swap in any subscribed feeds which finished downloading. Returns
+    # True if our database changed.
+    def update_subscriptions(self):
+        # Don't change things under the user whilst they're editing
+        if self.mode != 'search':
+            return False
+        changed = False
+        for feed, thread in self._refreshing[:]:
+            if thread.is_alive():
+                continue
+            self._refreshing.remove((feed, thread))
+            if feed.items is not None and not feed.stats.not_modified:
+                self._merge_subscription(feed.url, feed.items)
+                changed = True
+        if changed:
+            self.update_search()
+        return changed
+
+    # Do we store the user database in SQLite?
+    def use_sqlite(self):
+        return (self.config.database_backend == 'sqlite' or
+                os.path.splitext(self.filename)[1] in SQLITE_EXTENSIONS)
+
+    # Load the user database from SQLite
+    def load_store(self, merge=False):
+        from .sqlitestore import SQLiteStore
+        filename = os.path.expanduser(self.filename)
+        exists = os.path.isfile(filename)
+        if self.store is not None:
+            self.store.close()
+        self.store = SQLiteStore(filename)
+
+        # Start a new default database from the text one
+        if not exists and self.filename == DEFAULT_SQLITE_DATABASE_FILE:
+            items = self.get_file_items(DEFAULT_DATABASE_FILE)
+            if items:
+                self.store.add(items)
+                exists = True
+
+        items = self.store.load()
+        if items:
+            self.load_data(items, merge)
+            # Forget stored items which duplicate others
+            self.store.forget(
+                x for x in items
+                if self._item_keys.get(self._item_key(x)) is not x)
+        elif not exists:
+            return False
+        return items
+
+    # Save changes to our SQLite database, as for save_database()
+    def save_store(self, changes=None):
+        if changes is None:
+            self.store.sync(
+                x for x in self.database if not self.is_readonly(x))
+            self._database_changed()
+            return
+        added = []
+        for i, (op, key) in enumerate(changes):
+            item = self._item_keys.get(key)
+            if op == '+' and item is not None:
+                added.append(item)
+                continue
+            self.store.add(added)
+            added = []
+            nextop = changes[i+1][0] if i+1 < len(changes) else None
+            if op == '-' and nextop == '=':
+                newitem = self._item_keys.get(changes[i+1][1])
+                if newitem is not None:
+                    self.store.update(key, newitem)
+            elif op == '-':
+                self.store.remove([key])
+        self.store.add(added)
+        # What we have that isn't stored, and searches of it, have changed
+        self._database_changed()
+
+    # Our journal of changes to the user database
+    def journal_filename(self):
+        return os.path.expanduser(self.filename) + '.journal'
+
+    # Read our journal, return a list of (op, DBItem) changes. The op is
+    # '+' for added items, '-' for removed items, or '=' for the new
+    # version of an item removed by the previous change.
+    def get_journal(self):
+        filename = self.journal_filename()
+        if not os.path.isfile(filename):
+            return []
+        changes = []
+        for line in self.iter_file_lines(filename):
+            if line[:2] in ('+ ', '- ', '= '):
+                changes.append((line[0], DBItem(line[2:])))
+        return changes
+
+    # Apply the changes in our journal to our database
+    def replay_journal(self):
+        changes = self.get_journal()
+        self._journal_records = len(changes)
+        save_disabled = self.save_disabled
+        self.save_disabled = True
+        try:
+            for i, (op, item) in enumerate(changes):
+                nextop = changes[i+1][0] if i+1 < len(changes) else None
+                if op == '+':
+                    self._add_item(item)
+                # Edited items keep their place
+                elif op == '-' and nextop == '=':
+                    olditem = self._item_keys.get(self._item_key(item))
+                    newitem = changes[i+1][1]
+                    if olditem is None:
+                        self._add_item(newitem)
+                    elif self._update_item(
+                            olditem, newitem.label, newitem.cmd) is None:
+                        # Edited into a copy of another item
+                        self._remove_item(self._item_key(olditem))
+                elif op == '-':
+                    self._remove_item(self._item_key(item))
+        finally:
+            self.save_disabled = save_disabled
+        return bool(changes)
 
-    # Resort, if required
+    # Resort, if required. Results are only sorted as far as they're
+    # looked at.
     def sort(self):
+        self.results = ResultView(self.results.unordered(), self.sort_key())
+
+    # The key to sort our results by, or None if we don't sort them
+    def sort_key(self):
+        key = None
         if self.config.sort_by_label:
             if self.config.sort_case_sensitive:
-                self.results.sort(key=lambda x: x.label, reverse=False)
+                key = attrgetter('label')
             else:
-                self.results.sort(key=lambda x: x.label.lower(), reverse=False)
+                key = attrgetter('label_lower')
         elif self.config.sort_by_command:
             if self.config.sort_case_sensitive:
-                self.results.sort(key=lambda x: x.cmd, reverse=False)
+                key = attrgetter('cmd')
             else:
-                self.results.sort(key=lambda x: x.cmd.lower(), reverse=False)
+                key = attrgetter('cmd_lower')
+        # Commands we run most often and most recently go first, then the
+        # rest keep their order
+        if self.config.sort_by_frecency:
+            usage = self.get_usage()
+            if usage.stats:
+                now = time.time()
+                frecency = usage.frecency
+                if key is None:
+                    return lambda x: -frecency(x, now)
+                order = key
+                return lambda x: (-frecency(x, now), order(x))
+        return key
+
+    # The SQLite column to sort search results by
+    def _sort_column(self):
+        column = None
+        if self.config.sort_by_label:
+            column = 'label'
+        elif self.config.sort_by_command:
+            column = 'cmd'
+        if column and not self.config.sort_case_sensitive:
+            column += '_lower'
+        return column
+
+    # Save our DB. If we're told the changes made, as a list of (op,
+    # (cmd, label)) in the format of our journal, we can just append them
+    # to our journal.
+    def save_database(self, changes=None):
+        # Don't bother if disabled, or there is nothing to save
+        if self.save_disabled or changes == []:
+            return
+        # SQLite looks after itself
+        if self.store is not None:
+            self.save_store(changes)
+            return
+        dbname = os.path.realpath(os.path.expanduser(self.filename))
+        with self.lock_database():
+            if (self.config.database_journal and changes and
+                    self._journal_records < JOURNAL_COMPACT_THRESHOLD and
+                    os.path.isfile(dbname)):
+                stamp = self._disk_stamp(dbname)
+                self.append_journal(changes)
+                self._update_disk_state(dbname, changes, stamp)
+            else:
+                # Don't lose changes saved by anyone else
+                self.merge_database(dbname)
+                self.write_database(dbname)
+                self._disk_state = (dbname, self._disk_stamp(dbname), set(
+                    self._item_key(x) for x in self.database
+                    if not self.is_readonly(x)))
+
+    # Lock the user database against other processes whilst we load,
+    # change and save it. Locks may be nested.
+    @contextmanager
+    def lock_database(self):
+        if not self._lock_depth and fcntl:
+            dbname = os.path.realpath(os.path.expanduser(self.filename))
+            try:
+                self._lock_file = open(dbname + '.lock', "a")
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            except OSError:
+                # We can't lock here, carry on regardless
+                self._lock_file = None
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if not self._lock_depth and self._lock_file:
+                self._lock_file.close()
+                self._lock_file = None
+
+    # The state of the files holding the user database, used to see if
+    # anyone else has changed them
+    def _disk_stamp(self, dbname):
+        stamp = []
+        for filename in (dbname, self.journal_filename()):
+            try:
+                stat = os.stat(filename)
+                stamp.append((stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+    # Add items which other processes saved to the user database since we
+    # last loaded or saved it
+    def merge_database(self, dbname):
+        known = set()
+        if self._disk_state and self._disk_state[0] == dbname:
+            # Nothing has changed
+            if self._disk_state[1] == self._disk_stamp(dbname):
+                return
+            known = self._disk_state[2]
+        save_disabled = self.save_disabled
+        self.save_disabled = True
+        try:
+            for item in self.iter_user_items():
+                key = self._item_key(item)
+                if key not in known and key not in self._item_keys:
+                    self._add_item(item)
+        finally:
+            self.save_disabled = save_disabled
 
-    # Save our DB
-    def save_database(self):
-        # Don't bother if disabled
-        if self.save_disabled:
+    # Update what we know is on disk after saving some changes. stamp is
+    # the state of the files before we saved.
+    def _update_disk_state(self, dbname, changes, stamp):
+        if not self._disk_state or self._disk_state[0] != dbname:
             return
-        # Save to our user dir
-        dbname = os.path.expanduser(self.filename)
-        f = open(dbname, "wt")
-        for item in self.database:
-            # Don't save items from the system global database
-            if not self.is_global(item):
-                f.write("{0} [{1}]\n".format(item.cmd, item.label))
-        f.close()
-
-    # Print all commands
-    def print_commands(self):
-        for item in self.database:
+        _, oldstamp, keys = self._disk_state
+        for op, key in changes:
+            if op == '-':
+                keys.discard(key)
+            else:
+                keys.add(key)
+        # If someone else changed the files, we still need to merge them
+        if oldstamp == stamp:
+            stamp = self._disk_stamp(dbname)
+        else:
+            stamp = None
+        self._disk_state = (dbname, stamp, keys)
+
+    # Append some changes to our journal
+    def append_journal(self, changes):
+        records = [
+            "{0} {1} [{2}]\n".format(op, cmd, label)
+            for op, (cmd, label) in changes]
+        with open(self.journal_filename(), "at") as f:
+            f.writelines(records)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_records += len(records)
+
+    # Our record of which commands are run
+    def usage_filename(self):
+        return os.path.expanduser(self.filename) + '.usage'
+
+    # Get our record of which commands are run, loading it if we must,
+    # or if our database filename has changed since we did
+    def get_usage(self):
+        filename = self.usage_filename()
+        if self._usage is None or self._usage.filename != filename:
+            from .usage import UsageStore
+            self._usage = UsageStore(filename)
+            # Loading may rewrite the log
+            with self.lock_database():
+                self._usage.load()
+        return self._usage
+
+    # Record that we ran an item
+    def record_usage(self, item):
+        # Nothing reads our record unless we sort by it
+        if not self.config.sort_by_frecency:
+            return
+        from .usage import UsageStore
+        filename = self.usage_filename()
+        usage = self._usage
+        if usage is None or usage.filename != filename:
+            usage = UsageStore(filename)
+        try:
+            with self.lock_database():
+                usage.record(item)
+        except OSError:
+            # Not worth failing to run a command over
+            pass
+
+    # Write our entire database, safely replacing the old one
+    def write_database(self, dbname):
+        tmpname = "{0}.{1}.tmp".format(dbname, os.getpid())
+        try:
+            with open(tmpname, "wt") as f:
+                for item in self.database:
+                    # Don't save items from the system global database
+                    if not self.is_readonly(item):
+                        f.write("{0} [{1}]\n".format(item.cmd, item.label))
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.isfile(dbname):
+                os.chmod(tmpname, os.stat(dbname).st_mode & 0o7777)
+            os.replace(tmpname, dbname)
+        except BaseException:
+            if os.path.isfile(tmpname):
+                os.unlink(tmpname)
+            raise
+        # Our journal is now included in the database
+        if os.path.isfile(self.journal_filename()):
+            os.unlink(self.journal_filename())
+        self._journal_records = 0
+
+    # Print all commands, or just the given items
+    def print_commands(self, items=None):
+        if items is None:
+            items = self.database
+        for item in items:
             if self.config.show_labels:
                 print("[{0}] {1}".format(item.label, item.cmd))
             else:
@@ -224,28 +809,75 @@ class CmdManager():
     # Add an item to our DB
     def add_database_entry(self, entry, tags=None):
 
+        newitem = self._add_item(entry, tags)
+        if newitem is None:
+            return False
+
+        # Save first, so our search sees what's stored
+        self.save_database(self._saved_changes([newitem]))
+
+        # We can't be editing stuff now, default to search mode
+        self.search_mode()
+
+        return True
+
+    # Add many items to our DB, then refresh our search and save just once
+    # Returns the number of (added, duplicate) entries
+    def add_database_entries(self, entries, tags=None):
+        added, duplicates = self._add_items(entries, tags)
+        self._items_added(added)
+        return len(added), duplicates
+
+    # Add many items to our database, returns the list of new items and
+    # the number of duplicates
+    def _add_items(self, entries, tags=None):
+        # Sorting everything again when we next search is quicker than
+        # inserting lots of items into our sorted items one at a time
+        self._sorted = None
+        added = []
+        duplicates = 0
+        for entry in entries:
+            # Skip empty lines
+            if type(entry) is not DBItem and not entry.strip():
+                continue
+            newitem = self._add_item(entry, tags)
+            if newitem is not None:
+                added.append(newitem)
+            else:
+                duplicates += 1
+        return added, duplicates
+
+    # Refresh our search and save after adding items
+    def _items_added(self, added):
+        if added:
+            self.get_search_index()
+            self.save_database(self._saved_changes(added))
+            self.search_mode()
+
+    # Add a single item to our database, returns None if it's a duplicate
+    def _add_item(self, entry, tags=None):
+
         if type(entry) is DBItem:
             newitem = entry
         else:
             newitem = DBItem(entry)
 
         # Add item tags
-        if tags:
-            for tag in tags:
-                if tag not in newitem.tags:
-                    newitem.tags.append(tag)
+        newitem.add_tags(tags)
 
-        for item in self.database:
-            if item.cmd == newitem.cmd and item.label == newitem.label:
-                return False
+        key = self._item_key(newitem)
+        if key in self._item_keys:
+            return None
 
         self.database.append(newitem)
-        # We can't be editing stuff now, default to search mode
-        self.search_mode()
-
-        self.save_database()
-
-        return True
+        self._item_keys[key] = newitem
+        self._count_label(newitem.label, 1)
+        if self._search_index is not None:
+            self._search_index.add(newitem)
+        if self._sorted is not None:
+            self._sorted.add(newitem)
+        self._database_changed()
+        return newitem
 
     # Delete a database entry
     def delete_database_entry(self, dbitem):
@@ -253,11 +885,92 @@ class CmdManager():
         if not dbitem:
             return
 
-        for item in self.database:
-            if item.cmd == dbitem.cmd and item.label == dbitem.label:
-                self.database.remove(item)
-                break
-        self.save_database()
+        key = self._item_key(dbitem)
+        if self._remove_item(key) is not None:
+            self.save_database([('-', key)])
+
+    # Remove the item with a (cmd, label) key from our database
+    def _remove_item(self, key):
+        item = self._item_keys.pop(key, None)
+        if item is not None:
+            self.database.remove(item)
+            self._count_label(item.label, -1)
+            if self._search_index is not None:
+                self._search_index.remove(item)
+            if self._sorted is not None:
+                self._sorted.remove(item)
+            self._database_changed()
+        return item
+
+    # Remove many items from our database at once
+    def _remove_items(self, items):
+        removed = set()
+        for item in items:
+            key = self._item_key(item)
+            if self._item_keys.get(key) is item:
+                del self._item_keys[key]
+                self._count_label(item.label, -1)
+                removed.add(id(item))
+                if self._search_index is not None:
+                    self._search_index.remove(item)
+        if removed:
+            self.database[:] = [
+                x for x in self.database if id(x) not in removed]
+            self._sorted = None
+            self._database_changed()
+
+    # Count a label being added to or removed from our database
+    def _count_label(self, label, change):
+        width = len(label)
+        count = self._label_widths.get(width, 0) + change
+        if count > 0:
+            self._label_widths[width] = count
+        else:
+            self._label_widths.pop(width, None)
+
+    # Length of the longest label in our database
+    def label_width(self):
+        return max(self._label_widths) if self._label_widths else 0
+
+    # The identity of a database item, used to find duplicates
+    def _item_key(self, item):
+        return (item.cmd, item.label)
+
+    # Journal changes for adding items we save to the user database
+    def _saved_changes(self, items):
+        return [
+            ('+', self._item_key(x)) for x in items if not self.is_readonly(x)]
+
+    # Change the label and/or command of an item, keeping our index in sync
+    # Returns the old (cmd, label) key of the item, or None if the change
+    # would make it a duplicate of another item
+    def _update_item(self, item, label=None, cmd=None):
+        oldkey = self._item_key(item)
+        newkey = (oldkey[0] if cmd is None else cmd,
+                  oldkey[1] if label is None else label)
+        if newkey != oldkey and newkey in self._item_keys:
+            return None
+        if self._item_keys.get(oldkey) is item:
+            del self._item_keys[oldkey]
+        if self._search_index is not None:
+            self._search_index.discard(item)
+        # Edited items keep their place amongst equal items
+        order = None
+        if self._sorted is not None:
+            order = self._sorted.remove(item)
+        self._count_label(item.label, -1)
+        if label is not None:
+            item.label = label
+        if cmd is not None:
+            item.cmd = cmd
+        self._item_keys[newkey] = item
+        self._count_label(item.label, 1)
+        if self._search_index is not None:
+            self._search_index.add(item)
+        if self._sorted is not None:
+            self._sorted.add(item, order)
+        self._database_changed()
+        return oldkey
 
     # Add a new command from the edit line
     def add_new_command(self):
@@ -265,49 +978,243 @@ class CmdManager():
 
     # Delete the selected database entry
     def delete_selected_database_entry(self):
-        if self.is_global(self.selected_item):
-            self.ui.flash(
-                "Can't edit items from the system-wide database ({0})".format(
-                    self.sysfilename))
+        if self.is_readonly(self.selected_item):
+            self.flash_readonly(self.selected_item)
             return
         self.delete_database_entry(self.selected_item)
 
-    # Search for something
-    def _search(self, searchterm, labels=False, commands=False):
-        for item in self.database:
+    # Check if an item matches a search term, or a FuzzyMatcher if we're
+    # given one
+    def _matches(self, item, searchterm, labels=False, commands=False,
+                 fuzzy=None):
+        if fuzzy is not None:
+            return fuzzy.match_item(item, labels, commands)
+        if labels and item.label and searchterm in item.label_lower:
+            return True
+        return commands and searchterm in item.cmd_lower
+
+    # Search some items for something, return those which match
+    def _search(self, items, searchterm, labels=False, commands=False):
+        results = []
+        for item in items:
             matched = False
             if labels and item.label:
-                matched = searchterm in item.label.lower()
+                matched = searchterm in item.label_lower
             if commands and not matched:
-                matched = searchterm in item.cmd.lower()
+                matched = searchterm in item.cmd_lower
             if matched:
-                self.results.append(item)
+                results.append(item)
+        return results
+
+    # Filter some items a chunk at a time, so a search can be put aside
+    # whilst we deal with key presses. A generator, yielding the matches so
+    # far after each chunk and returning all of them.
+    def _search_chunks(self, items, search):
+        results = []
+        for start in range(0, len(items), SEARCH_CHUNK_SIZE):
+            results += search(items[start:start + SEARCH_CHUNK_SIZE])
+            yield results
+        return results
+
+    # Run a search generator to the end, returning its matches
+    def _finish(self, search):
+        while True:
+            try:
+                next(search)
+            except StopIteration as ex:
+                return ex.value
+
+    # Search for something, narrowing down earlier search results if we can
+    # If a search term extends an earlier one its matches must be a subset
+    # of the earlier matches, so we keep a stack of recent searches.
+    # A FuzzyMatcher may be given to find fuzzy matches instead.
+    # A generator, see _search_chunks().
+    def _narrow_search(self, searchterm, labels=False, commands=False,
+                       base=None, fuzzy=None):
+        # Drop searches which aren't a prefix of this one (e.g. backspace)
+        stack = self._search_stack
+        while stack and not searchterm.startswith(stack[-1][0]):
+            stack.pop()
+        if not stack or stack[-1][0] != searchterm:
+            stack.append((searchterm, {}))
+            if len(stack) > SEARCH_STACK_SIZE:
+                del stack[0]
+
+        # Find the closest earlier search of the same kind
+        kind = (labels, commands, fuzzy is not None)
+        items = self._search_base()[0] if base is None else base
+        for term, found in reversed(stack):
+            if kind in found:
+                items = found[kind]
+                if term == searchterm:
+                    return items
+                break
 
-    # Calculate search results
+        if fuzzy is not None:
+            results = yield from self._search_chunks(
+                items, lambda x: fuzzy.filter(x, labels, commands))
+            stack[-1][1][kind] = results
+            return results
+
+        # Perhaps our search index can find fewer candidates
+        index = self.get_search_index() if base is None else None
+        if index is not None:
+            candidates = index.candidates(searchterm, labels, commands)
+            if candidates is not None and len(candidates) < len(items):
+                items = candidates
+
+        results = yield from self._search_chunks(
+            items, lambda x: self._search(x, searchterm, labels, commands))
+        stack[-1][1][kind] = results
+        return results
+
+    # The items we search, in sort order if we can keep them that way so
+    # our results need no sorting. Returns the items and whether they're
+    # already sorted.
+    def _search_base(self):
+        # Our search index finds items in database order, and frecency
+        # changes as commands are run
+        if self.config.search_index or self.config.sort_by_frecency:
+            return self.database, False
+        if self.config.sort_by_label:
+            attr = 'label' if self.config.sort_case_sensitive else 'label_lower'
+        elif self.config.sort_by_command:
+            attr = 'cmd' if self.config.sort_case_sensitive else 'cmd_lower'
+        else:
+            return self.database, True
+        if self._sorted is None or self._sorted.attr != attr:
+            self._sorted = SortedItems(self.database, attr)
+        return self._sorted.items, True
+
+    # Get our trigram search index, building it if it's enabled, and
+    # dropping it if it's been turned off
+    def get_search_index(self):
+        if not self.config.search_index:
+            self._search_index = None
+        elif self._search_index is None:
+            self._search_index = TrigramIndex(self.database)
+        return self._search_index
+
+    # Search for something, in our SQLite store if we have one. Returns
+    # the matches and whether they are already sorted.
+    # A generator, see _search_chunks().
+    def _find(self, searchterm, labels=False, commands=False):
+        if self.store is None:
+            results = yield from self._narrow_search(
+                searchterm, labels, commands)
+            return results, self._search_base()[1]
+
+        # Search what isn't stored ourselves, e.g. the global database
+        if self._unstored is None:
+            self._unstored = [x for x in self.database if x not in self.store]
+        unstored = yield from self._narrow_search(
+            searchterm, labels, commands, self._unstored)
+        stored = self.store.search(
+            searchterm, labels, commands, self._sort_column())
+        if not unstored and not self.config.sort_by_frecency:
+            return stored, True
+        return unstored + stored, False
+
+    # Fuzzy search for something, returns the matches best first
+    # A generator, see _search_chunks().
+    def _fuzzy_find(self, searchterm):
+        from .fuzzy import FuzzyMatcher
+        matcher = FuzzyMatcher(searchterm)
+        labels = True
+        commands = not self.config.search_labels_only
+        candidates = yield from self._narrow_search(
+            searchterm, labels, commands, fuzzy=matcher)
+        return matcher.rank(
+            candidates, labels, commands, self.config.fuzzy_limit)
+
+    # Our database has changed, forget any earlier search results
+    def _database_changed(self):
+        self._search_stack.clear()
+        self._unstored = None
+        # Start again on any search we're part way through
+        if self._searching is not None:
+            self._searching = self._search_results()
+
+    # Calculate search results, in the background if we're searching
+    # between key presses
     def update_search(self):
-        self.results.clear()
+        # Earlier searches are only useful with the same search options
+        options = (self.config.search_labels_first,
+                   self.config.search_labels_only,
+                   self.config.fuzzy_search,
+                   self.config.search_index,
+                   self.config.sort_by_label,
+                   self.config.sort_by_command,
+                   self.config.sort_case_sensitive,
+                   self.config.sort_by_frecency)
+        if options != self._search_options:
+            self._search_options = options
+            self._database_changed()
+
+        self._searching = self._search_results()
+        if not self.background_search:
+            self.finish_search()
+
+    # Are we part way through a search?
+    def searching(self):
+        return self._searching is not None
+
+    # Carry on with our search for a little while, showing what we've
+    # found so far. Returns True once the search is finished.
+    def continue_search(self):
+        if self._searching is None:
+            return True
+        deadline = time.monotonic() + SEARCH_SLICE
+        for found in self._searching:
+            if time.monotonic() >= deadline:
+                self.results = ResultView(found[:], self.sort_key())
+                self.selected_row = self.selected_row
+                return False
+        self._searching = None
+        return True
+
+    # Finish our search, however long it takes
+    def finish_search(self):
+        if self._searching is not None:
+            search, self._searching = self._searching, None
+            self._finish(search)
+
+    # Search for the search term, a generator which yields the matches so
+    # far as it goes and sets our results when it's done
+    def _search_results(self):
+        searchterm = self.ui.input.value.lower()
 
         # Special case of no search term
-        if not self.ui.input.value:
-            self.results = self.database[:]
+        label_width = None
+        if not searchterm:
+            results, ordered = self._search_base()
+            # Our database may change under us
+            results = results[:]
+            label_width = self.label_width()
+        # Fuzzy search, best matches first
+        elif self.config.fuzzy_search:
+            results = yield from self._fuzzy_find(searchterm)
+            ordered = True
         # Search labels, then commands if no labels found
         elif self.config.search_labels_first:
-            self._search(self.ui.input.value.lower(), True, False)
-            if not len(self.results):
-                self._search(self.ui.input.value.lower(), False, True)
+            results, ordered = yield from self._find(searchterm, True, False)
+            if not results:
+                results, ordered = yield from self._find(
+                    searchterm, False, True)
         # Search labels only
         elif self.config.search_labels_only:
-            self._search(self.ui.input.value.lower(), True, False)
+            results, ordered = yield from self._find(searchterm, True, False)
         # Search both labels and command
         else:
-            self._search(self.ui.input.value.lower(), True, True)
+            results, ordered = yield from self._find(searchterm, True, True)
+
+        # Sort the results, unless they already are
+        self.results = ResultView(
+            results, None if ordered else self.sort_key(), label_width)
 
         # Refresh selection
         self.selected_row = self.selected_row
 
-        # Sort the results
-        self.sort()
-
     # Move the selected row down
     def selection_down(self):
         self.selected_row += 1
@@ -375,28 +1282,53 @@ class CmdManager():
     def is_global(self, item):
         return item and 'global' in item.tags
 
-    # Update the selected items label
-    def update_selected_label(self):
-        if self.is_global(self.selected_item):
+    # Check if an item is from a subscribed feed
+    def is_subscribed(self, item):
+        return item and 'subscribed' in item.tags
+
+    # Check if an item can't be changed
+    def is_readonly(self, item):
+        return self.is_global(item) or self.is_subscribed(item)
+
+    # Tell the user why they can't change an item
+    def flash_readonly(self, item):
+        if self.is_global(item):
             self.ui.flash(
                 "Can't edit items from the system-wide database ({0})".format(
                     self.sysfilename))
+        else:
+            self.ui.flash("Can't edit items from subscribed databases")
+
+    # Tell the user an edit would duplicate another item
+    def flash_duplicate(self):
+        self.ui.flash("That command is already in the database")
+
+    # Update the selected items label
+    def update_selected_label(self):
+        if self.is_readonly(self.selected_item):
+            self.flash_readonly(self.selected_item)
             self.search_mode()
             return
-        self.selected_item.label = self.ui.input.value
-        self.save_database()
+        item = self.selected_item
+        oldkey = self._update_item(item, label=self.ui.input.value)
+        if oldkey is None:
+            self.flash_duplicate()
+        else:
+            self.save_database([('-', oldkey), ('=', self._item_key(item))])
         self.search_mode()
 
     # Update the selected items command
     def update_selected_command(self):
-        if self.is_global(self.selected_item):
-            self.ui.flash(
-                "Can't edit items from the system-wide database ({0})".format(
-                    self.sysfilename))
+        if self.is_readonly(self.selected_item):
+            self.flash_readonly(self.selected_item)
             self.search_mode()
             return
-        self.selected_item.cmd = self.ui.input.value
-        self.save_database()
+        item = self.selected_item
+        oldkey = self._update_item(item, cmd=self.ui.input.value)
+        if oldkey is None:
+            self.flash_duplicate()
+        else:
+            self.save_database([('-', oldkey), ('=', self._item_key(item))])
         self.search_mode()
 
     # Execute the selected command
@@ -413,6 +1345,8 @@ class CmdManager():
             if not self.ui.confirm("Are you sure? (y/n)"):
                 return
 
+        self.record_usage(dbitem)
+
         # Our process is about to be replaced, normal orderly
         # shutdown won't happen
         self.ui.finalise_display()
@@ -424,9 +1358,56 @@ class CmdManager():
                 print(dbitem.cmd)
             os.execv(self.shell, params)
         else:
+            import subprocess
             result = subprocess.check_output(dbitem.cmd.split())
             return result.decode('utf-8').strip()
 
+    # Try to run the single command matching a search term, streaming the
+    # database files without loading them, sorting or starting the UI.
+    # Returns False if there isn't exactly one match, so the interactive
+    # UI is needed after all.
+    def quick_run(self, searchterm):
+        searchterm = searchterm.lower()
+        if not searchterm:
+            return False
+
+        # The fields we search, in order of preference, matching those
+        # update_search() would
+        fuzzy = None
+        if self.config.fuzzy_search:
+            from .fuzzy import FuzzyMatcher
+            fuzzy = FuzzyMatcher(searchterm)
+            fields = [(True, not self.config.search_labels_only)]
+        elif self.config.search_labels_first:
+            fields = [(True, False), (False, True)]
+        elif self.config.search_labels_only:
+            fields = [(True, False)]
+        else:
+            fields = [(True, True)]
+
+        matches = [[] for x in fields]
+        for item in self.iter_database():
+            for found, (labels, commands) in zip(matches, fields):
+                if len(found) < 2 and self._matches(
+                        item, searchterm, labels, commands, fuzzy):
+                    found.append(item)
+            # A second match of our preferred fields is ambiguous
+            if len(matches[0]) > 1:
+                return False
+
+        for found in matches:
+            if found:
+                break
+        if len(found) != 1:
+            return False
+
+        # Commands needing confirmation need the UI
+        item = found[0]
+        if item.label.endswith('!'):
+            return False
+        self.execute_command(item)
+        return True
+
     # Check and execute auto run
     def do_autorun(self):
         # Auto run?
@@ -448,15 +1429,23 @@ class CmdManager():
 
         self.ui.initialise_display()
 
+        # Refresh our subscriptions whilst the user gets on with things
+        self.refresh_subscriptions()
+
         # If passed a search term, try to auto run it
         if cmd:
             self.ui.input.set_value(cmd)
             self.do_autorun()
 
+        # Don't keep the user waiting on searches whilst they type
+        self.background_search = True
+
         try:
             while True and cmd != '#AUTOEXIT#':
+                self.update_subscriptions()
+                self.continue_search()
                 self.ui.redraw()
-                self.ui.get_input()
+                self.ui.get_all_input()
         finally:
             self.ui.finalise_display()
 
@@ -1,6 +1,5 @@
 # config.py
 import os
-import configparser
 
 
 class Config():
@@ -22,17 +21,29 @@ class Config():
             'whole-line-selection': True,
             'search-labels-only': False,
             'search-labels-first': True,
+            'search-index': False,
+            'fuzzy-search': False,
+            'fuzzy-limit': 0,
             'shell': 'default',
             'sort-by-label': True,
             'sort-by-command': False,
             'sort-case-sensitive': True,
+            'sort-by-frecency': False,
             'display-help-footer': True,
+            'bracketed-paste': True,
             'load-global-database': True,
+            'cache-databases': True,
+            'database-journal': False,
+            'database-backend': 'text',
+            'import-timeout': 30,
+            'subscriptions': '',
+            'subscription-ttl': 3600,
         }
 
         # If there is a config file merge that in too
         filename = os.path.expanduser(Config.DEFAULT_CONFIG_FILE)
         if os.path.isfile(filename):
+            import configparser
             parser = configparser.ConfigParser()
             parser.read(filename)
             if parser.has_section('xxcmd'):
@@ -73,6 +84,7 @@ class Config():
             config['xxcmd'][key] = value
 
         # Write out our config
+        import configparser
         parser = configparser.ConfigParser()
         parser.read_dict(config)
         with open(filename, 'w') as outfile:
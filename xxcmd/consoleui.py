@@ -1,131 +1,207 @@
 # consoleui.py
 import os
-import curses
-import locale
+import sys
 import time
+import importlib
 from .lineedit import LineEdit
 
 
+# A module which is only imported when it's first used
+class LazyModule():
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# Not every code path needs a display
+curses = LazyModule('curses')
+
+# How often we check for background work whilst waiting for a key
+INPUT_POLL_MS = 100
+
+# Shown whilst we're part way through a search
+SEARCHING = 'searching...'
+
+# Terminal sequences to turn bracketed paste on and off, and those it
+# puts around pasted text
+PASTE_ON = '\x1b[?2004h'
+PASTE_OFF = '\x1b[?2004l'
+PASTE_START = '\x1b[200~'
+PASTE_END = '\x1b[201~'
+
+
+# Where things go on the screen, for a given window size
+class Layout():
+
+    def __init__(self, height=0, width=0, border=True, footer=True):
+        self.height = height
+        self.width = width
+        # The input prompt
+        self.prompt_x = 1 if border else 0
+        self.prompt_y = 1 if border else 0
+        # Result window region, default the entire screen
+        self.minx = 0
+        self.miny = 1
+        self.maxx = width - 1
+        self.maxy = height - 1
+        # Adjust if window border
+        if border:
+            self.minx += 1
+            self.miny += 2
+            self.maxx -= 1
+            self.maxy -= 1
+        # Adjust if help footer
+        if footer:
+            self.maxy -= 1
+
+    def __eq__(self, other):
+        return vars(self) == vars(other)
+
+
 # Curses UI for our application
 class ConsoleUI():
 
+    # Dev mode display, may be set to a function to look it up only when
+    # it's first displayed
+    @property
+    def dev(self):
+        if callable(self._dev):
+            self._dev = self._dev()
+        return self._dev
+
+    @dev.setter
+    def dev(self, value):
+        self._dev = value
+
     def __init__(self, parent):
         # Our parent
         self.parent = parent
         # Our curses window
         self.win = None
-        # And dimensions of it
-        self.win_width = 0
-        self.win_height = 0
-        # Default locations of things
-        self.prompt_pos = {'x': 1, 'y': 1}
+        # Where things go in it
+        self.layout = Layout()
         # Input line edit
         self.input = LineEdit()
         # Input line prefix
         self.input_prefix = ''
         # Key press event handlers
         self.key_events = {}
+        # Keys we've read but not dealt with yet
+        self._pending_keys = []
         # Offset for scrolling through the list
         self.row_offset = 1
         # Offset for editing long lines
         self.col_offset = 1
         # Dev mode display
-        self.dev = ''
-        # Result window region
-        self.cmd_region = {
-            'minx': 0,
-            'miny': 0,
-            'maxx': self.win_width-1,
-            'maxy': self.win_height-1
-        }
+        self._dev = ''
+        # What we last drew on each row, so we only redraw rows which
+        # have changed
+        self._drawn_rows = {}
         # Default help footer text
         self.help_row = (
             "Return:Run  F1:Edit Label  "
             "F2:Edit Cmd  F3:Add New  Del:Delete"
         )
-        # Set locale
-        locale.setlocale(locale.LC_ALL, '')
 
     # Initialise our display
     def initialise_display(self):
-        # Update some options from our latest runtime config
-        if not self.parent.config.draw_window_border:
-            self.prompt_pos = {'x': 0, 'y': 0}
+        # Set locale
+        import locale
+        locale.setlocale(locale.LC_ALL, '')
         self.win = curses.initscr()
         curses.noecho()
         self.win.keypad(True)
         curses.cbreak()
         curses.curs_set(1)
+        # Have pasted text marked, so we can take it all at once
+        if self.parent.config.bracketed_paste:
+            sys.stdout.write(PASTE_ON)
+            sys.stdout.flush()
+        self.invalidate()
         self.resize()
 
     # Finalise our display
     def finalise_display(self):
+        if not self.win:
+            return
+        if self.parent.config.bracketed_paste:
+            sys.stdout.write(PASTE_OFF)
+            sys.stdout.flush()
         curses.nocbreak()
         curses.echo()
         self.win.keypad(False)
         curses.endwin()
         self.win = None
 
-    # Recalculate window regions
+    # Forget what we've drawn, so the next redraw draws everything
+    def invalidate(self):
+        self._drawn_rows.clear()
+
+    # Recalculate where things go, only needed when our window changes
+    # size (or our config changes)
     def resize(self):
-        # Get the latest window size
-        self.win_height, self.win_width = self.win.getmaxyx()
-        # Default the entire screen
-        self.cmd_region = {
-            'minx': 0,
-            'miny': 1,
-            'maxx': self.win_width-1,
-            'maxy': self.win_height-1,
-        }
-        # Adjust if window border
-        if self.parent.config.draw_window_border:
-            self.cmd_region['minx'] += 1
-            self.cmd_region['miny'] += 2
-            self.cmd_region['maxx'] -= 1
-            self.cmd_region['maxy'] -= 1
-        # Adjust if help footer
-        if self.parent.config.display_help_footer:
-            self.cmd_region['maxy'] -= 1
+        height, width = self.win.getmaxyx()
+        layout = Layout(
+            height, width, self.parent.config.draw_window_border,
+            self.parent.config.display_help_footer)
+        if layout != self.layout:
+            self.layout = layout
+            self.invalidate()
 
     # Print some text
-    def print_at(self, y, x, text, attrib=curses.A_NORMAL):
-        # Get the latest window size
-        self.resize()
+    def print_at(self, y, x, text, attrib=None):
+        if attrib is None:
+            attrib = curses.A_NORMAL
         # Really, really small term?
-        if self.win_width <= 2 or self.win_height <= 2:
+        if self.layout.width <= 2 or self.layout.height <= 2:
             return
         # Text out of the term totally?
-        if y < 0 or y >= self.win_height or x < 0 or x >= self.win_width-1:
+        if y < 0 or y >= self.layout.height or x < 0 or x >= self.layout.width-1:
             return
         # Plot the text
-        text = text[:self.win_width - (x+1)]
+        text = text[:self.layout.width - (x+1)]
         self.win.addstr(y, x, text, attrib)
 
     # Print a line of text
-    def print_line_at(self, y, x, text, attrib=curses.A_NORMAL):
+    def print_line_at(self, y, x, text, attrib=None):
         self.print_at(y, x, text, attrib)
         self.win.clrtoeol()
 
+    # Draw a row as a list of (x, text, attrib) segments, unless it's
+    # unchanged since we last drew it. Returns True if we drew it.
+    def draw_row(self, y, segments):
+        if self._drawn_rows.get(y) == segments:
+            return False
+        self._drawn_rows[y] = segments
+        for x, text, attrib in segments:
+            self.print_line_at(y, x, text, attrib)
+        return True
+
     # Draw a horizontal line
     def hline(self, y):
-        # Get the latest window size
-        self.resize()
         # Really, really small term?
-        if self.win_width <= 2 or self.win_height <= 3:
+        if self.layout.width <= 2 or self.layout.height <= 3:
             return
-        self.win.hline(2, 1, curses.ACS_HLINE, self.win_width-2)
+        self.win.hline(2, 1, curses.ACS_HLINE, self.layout.width-2)
         self.win.addch(2, 0, curses.ACS_LTEE)
-        self.win.addch(2, self.win_width-1, curses.ACS_RTEE)
+        self.win.addch(2, self.layout.width-1, curses.ACS_RTEE)
 
     # Term row to array index
     def termrow_to_idx(self, row):
-        return (row + self.row_offset) - self.cmd_region['miny']
+        return (row + self.row_offset) - self.layout.miny
 
     # Flash a brief message
     def flash(self, message):
         if not self.win:
             return
-        self.print_line_at(self.prompt_pos['y'], self.prompt_pos['x'], message)
+        self.print_line_at(self.layout.prompt_y, self.layout.prompt_x, message)
+        self._drawn_rows.pop(self.layout.prompt_y, None)
         self.win.refresh()
         time.sleep(1)
 
@@ -133,10 +209,10 @@ class ConsoleUI():
     def confirm(self, message, key=None):
         if not self.win:
             return
-        width = int(self.win_width * 0.8)
+        width = int(self.layout.width * 0.8)
         height = 3
-        posx = int((self.win_width - width) / 2)
-        posy = int((self.win_height - height) / 2)
+        posx = int((self.layout.width - width) / 2)
+        posy = int((self.layout.height - height) / 2)
         dialog = curses.newwin(height, width, posy, posx)
         dialog.box()
         textx = int((width - len(message)) / 2)
@@ -147,45 +223,63 @@ class ConsoleUI():
         if not key:
             key = dialog.getch()
         del dialog
+        # Our window needs drawing again where the dialog was
+        self.invalidate()
         if key == 121 or key == 89:
             return True
         return False
 
     # Update our window output
     def redraw(self):
+        layout = self.layout
 
         # Calculate row offset for scrolling
         self.row_offset = self.parent.selected_row - (
-            self.cmd_region['maxy'] - self.cmd_region['miny'])
+            layout.maxy - layout.miny)
         if self.row_offset < 0:
             self.row_offset = 0
 
         # Calculate column offset for scrolling
         self.col_offset = self.input.cursor - (
-            self.win_width - (self.cmd_region['minx'] + 2 + len(self.input_prefix)))
+            layout.width - (layout.minx + 2 + len(self.input_prefix)))
         if self.col_offset < 0:
             self.col_offset = 0
 
+        # Drawing everything? Make sure it all reaches the terminal.
+        if not self._drawn_rows:
+            self.win.touchwin()
+
         # Print the input line
         line = self.input.value
         line = line[self.col_offset:]
-        self.print_line_at(
-            self.prompt_pos['y'], self.prompt_pos['x'],
-            "{0}{1}".format(self.input_prefix, line))
+        prompt = "{0}{1}".format(self.input_prefix, line)
+        segments = ((layout.prompt_x, prompt, None),)
+        # Let the user know there are more results to come
+        if self.parent.searching():
+            x = layout.maxx + 1 - len(SEARCHING)
+            if x > layout.prompt_x + len(prompt):
+                segments += ((x, SEARCHING, None),)
+        changed = self.draw_row(layout.prompt_y, segments)
 
         # Determine max label length for indenting
         indent = 0
-        if self.parent.config.align_commands:
-            for item in self.parent.results:
-                if len(item.label) > indent:
-                    indent = len(item.label)
+        align = self.parent.config.align_commands
+        if align == 'visible':
+            # Only line up the results on screen
+            first = self.termrow_to_idx(layout.miny)
+            visible = self.parent.results[
+                first:first + layout.maxy - layout.miny + 1]
+            indent = max([len(x.label) for x in visible] or [0])
+        elif align:
+            indent = self.parent.results.label_width()
+        if align:
             indent += self.parent.config.label_padding
             if self.parent.config.bracket_labels:
                 indent += 1
 
         # Display current search results
-        y = self.cmd_region['miny']
-        last_row = self.cmd_region['maxy']
+        y = layout.miny
+        last_row = layout.maxy
         while y <= last_row:
 
             idx = self.termrow_to_idx(y)
@@ -199,6 +293,7 @@ class ConsoleUI():
             if idx < len(self.parent.results):
                 item = self.parent.results[idx]
                 label = ''
+                segments = []
 
                 # Showing labels?
                 if self.parent.config.show_labels:
@@ -211,8 +306,8 @@ class ConsoleUI():
                         if attrib == curses.A_NORMAL:
                             attrib = curses.A_BOLD
                     # Print label
-                    self.print_line_at(
-                        y, self.cmd_region['minx'], label.ljust(indent), attrib)
+                    segments.append(
+                        (layout.minx, label.ljust(indent), attrib))
                     # Reset text attributes
                     if attrib == curses.A_BOLD:
                         attrib = curses.A_NORMAL
@@ -228,62 +323,158 @@ class ConsoleUI():
                     cmd = ''
                 if self.parent.config.whole_line_selection:
                     cmd = cmd.ljust(
-                        self.win_width - indent - self.cmd_region['minx'])
-                self.print_line_at(
-                    y, self.cmd_region['minx'] + indent, cmd, attrib)
+                        layout.width - indent - layout.minx)
+                segments.append((layout.minx + indent, cmd, attrib))
+                changed |= self.draw_row(y, tuple(segments))
 
             else:
                 # Fill the rest of the space with blank lines
-                self.print_line_at(y, self.cmd_region['minx'], "", attrib)
+                changed |= self.draw_row(
+                    y, ((layout.minx, "", attrib),))
 
             y += 1
 
         # Display help footer
         if self.parent.config.display_help_footer:
             footer = self.help_row
-            helprow = self.cmd_region['maxy'] + 1
-            footer = footer.rjust(self.cmd_region['maxx'] - self.cmd_region['minx'])
-            self.print_line_at(
-                helprow, self.cmd_region['minx'], footer)
+            helprow = layout.maxy + 1
+            footer = footer.rjust(layout.maxx - layout.minx)
+            changed |= self.draw_row(
+                helprow, ((layout.minx, footer, None),))
 
-        # Draw lines for boxes
-        if self.parent.config.draw_window_border:
+        # Draw lines for boxes, clearing the rows we drew wiped out the edges
+        if self.parent.config.draw_window_border and changed:
             self.win.box()
             self.hline(2)
             # In dev mode display version footer
             if self.dev:
                 self.print_at(
-                    self.win_height-1, self.win_width - (len(self.dev) + 2), self.dev)
+                    layout.height-1, layout.width - (len(self.dev) + 2), self.dev)
 
         # Move visual cursor
         curx = len(self.input_prefix) + (
-            (self.input.cursor + self.prompt_pos['x']) - self.col_offset)
-        if curx < self.win_width:
-            self.win.move(self.prompt_pos['y'], curx)
-
-        self.win.refresh()
+            (self.input.cursor + layout.prompt_x) - self.col_offset)
+        if curx < layout.width:
+            self.win.move(layout.prompt_y, curx)
+
+        # Send all our changes to the terminal at once
+        self.win.noutrefresh()
+        curses.doupdate()
+
+    # Read a key press, None if there wasn't one within timeout
+    # milliseconds. Without a timeout we wait for a key, or for long enough
+    # to check on background work.
+    def read_key(self, timeout=None):
+        if self._pending_keys:
+            return self._pending_keys.pop(0)
+        if timeout is None:
+            if self.parent.searching():
+                timeout = 0
+            elif self.parent.refresh_pending():
+                timeout = INPUT_POLL_MS
+            else:
+                timeout = -1
+        self.win.timeout(timeout)
+        try:
+            return self.win.get_wch()
+        except KeyboardInterrupt:    # pragma: no cover
+            exit(0)
+        except curses.error:
+            # Nothing pressed
+            return None
 
     # Get input
     def get_input(self, key=None):
 
+        # Get a key press if we weren't passed one
+        if not key:    # pragma: no cover
+            key = self.read_key()
+            if key is None:
+                return None
+
+        # Trigger other event handlers
+        # Don't trigger "always" events if mode changed
+        if self.handle_key(key):
+            self.always()
+
+        return key
+
+    # Get every key press which is waiting, triggering "always" events just
+    # once at the end so a burst of typing only searches once
+    def get_all_input(self):
+        key = self.read_key()
+        always = False
+        while key is not None:
+            pasted = self.read_paste() if key == PASTE_START[0] else None
+            if pasted is not None:
+                self.input.insert(pasted)
+                always = True
+            else:
+                # Catch up before other event handlers act on what we typed
+                if always and self.decode_key(key)[0] in self.key_events:
+                    self.always()
+                always = self.handle_key(key)
+            key = self.read_key(0)
+        if always:
+            self.always()
+
+    # Read pasted text, if the escape key we just read started a bracketed
+    # paste. Otherwise returns None, leaving the keys we looked at to be
+    # read again.
+    def read_paste(self):
+        keys = []
+        for char in PASTE_START[1:]:
+            key = self.read_key(0)
+            if key is not None:
+                keys.append(key)
+            if key != char:
+                self._pending_keys[:0] = keys
+                return None
+
+        # Take everything up to the end of the paste, giving up if the
+        # rest doesn't arrive
+        pasted = []
+        while ''.join(pasted[-len(PASTE_END):]) != PASTE_END:
+            key = self.read_key(INPUT_POLL_MS)
+            if key is None:
+                break
+            # Special keys don't belong in our text
+            if type(key) is str:
+                pasted.append(key)
+        text = ''.join(pasted)
+        if text.endswith(PASTE_END):
+            text = text[:-len(PASTE_END)]
+
+        # We only edit a single line
+        return ' '.join(text.splitlines())
+
+    # Trigger our "always" event handler, if we have one
+    def always(self):
+        if 'ALWAYS' in self.key_events:
+            self.key_events['ALWAYS']()
+
+    # Get the name of a special key. Returns the key and whether it was
+    # special.
+    def decode_key(self, key):
+        if type(key) is int:
+            return curses.keyname(key).decode('utf-8'), True
+        return key, False
+
+    # Act on a key press. Returns True if we're still in the same mode, so
+    # "always" events should be triggered.
+    def handle_key(self, key):
+
         # Remember our starting mode
         mode = self.parent.mode
 
-        try:
-            # Get a key press if we weren't passed one
-            if not key:    # pragma: no cover
-                key = self.win.get_wch()
-        except KeyboardInterrupt:    # pragma: no cover
-            exit(0)
-
         # Pre-process our key
-        decoded = False
-        if type(key) is int:
-            decoded = True
-            key = curses.keyname(key).decode('utf-8')
+        key, decoded = self.decode_key(key)
 
+        # Our window changed size
+        if key == 'KEY_RESIZE':
+            self.resize()
         # Support backspace
-        if key == 'KEY_BACKSPACE' or key == '\x7f' or key == '\x08':
+        elif key == 'KEY_BACKSPACE' or key == '\x7f' or key == '\x08':
             self.input.delchar()
         # Cursor movements
         elif key == 'KEY_LEFT':
@@ -305,13 +496,7 @@ class ConsoleUI():
         elif not decoded:
             self.input.addchar(key)
 
-        # Trigger other event handlers
-
-        # Don't trigger "always" events if mode changed
-        if 'ALWAYS' in self.key_events.keys() and mode == self.parent.mode:
-            self.key_events['ALWAYS']()
-
-        return key
+        return mode == self.parent.mode
 
     # Display what curses sees when keys are pressed
     # Useful only for debugging terminal key press data
@@ -334,7 +519,7 @@ class ConsoleUI():
                 self.win.addstr(y, 0, info)
                 y += 1
 
-                if y >= self.win_height-1:
+                if y >= self.layout.height-1:
                     self.win.clear()
                     y = 0
 
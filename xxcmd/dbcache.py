@@ -0,0 +1,89 @@
+# dbcache.py
+# An on-disk cache of parsed command database files
+import os
+import zlib
+import marshal
+from .dbitem import DBItem
+
+
+# Change this if the cached data format changes
+CACHE_VERSION = 1
+
+
+# Cache filename in a directory for something with a full name, e.g. a
+# file or URL. The full name should be checked when loading, so a clash
+# only costs a cache miss.
+def cache_path(cachedir, prefix, fullname, suffix):
+    name = "{0}-{1:08x}{2}".format(
+        prefix, zlib.crc32(fullname.encode('utf-8')), suffix)
+    return os.path.join(cachedir, name)
+
+
+# Read a cache file written by write_cache(). Returns (header, items), or
+# None if it's missing, broken, or valid(header) is false. The header is
+# checked before we bother reading any items.
+def read_cache(path, valid):
+    try:
+        with open(path, "rb") as infile:
+            header = marshal.load(infile)
+            if not valid(header):
+                return None
+            return header, DBItem.from_rows(marshal.load(infile))
+    except Exception:
+        # Missing or broken caches are just rebuilt
+        return None
+
+
+# Write a header and some items to a cache file, safely replacing any old
+# one. Caching is just an optimisation, returns False if we can't.
+def write_cache(cachedir, path, header, items):
+    import tempfile
+    try:
+        os.makedirs(cachedir, exist_ok=True)
+        handle, tmpname = tempfile.mkstemp(dir=cachedir)
+    except OSError:
+        return False
+    try:
+        with os.fdopen(handle, "wb") as outfile:
+            marshal.dump(header, outfile)
+            marshal.dump(DBItem.to_rows(items), outfile)
+        os.replace(tmpname, path)
+    except OSError:
+        os.unlink(tmpname)
+        return False
+    return True
+
+
+class DatabaseCache():
+
+    def __init__(self, cachedir):
+        self.cachedir = os.path.expanduser(cachedir)
+
+    # Cache filename for a database file
+    def path(self, filename):
+        return cache_path(
+            self.cachedir, os.path.basename(filename), filename, '.cache')
+
+    # Key that tells us if a database file has changed
+    def key(self, filename, stat):
+        return (CACHE_VERSION, marshal.version, filename, stat.st_size,
+                stat.st_mtime_ns)
+
+    # Get the cached items for a database file, None if we don't have
+    # an up to date cache
+    def load(self, filename):
+        filename = os.path.realpath(os.path.expanduser(filename))
+        try:
+            key = self.key(filename, os.stat(filename))
+        except OSError:
+            return None
+        cached = read_cache(self.path(filename), lambda x: x == key)
+        return None if cached is None else cached[1]
+
+    # Cache the items parsed from a database file. stat is the state of
+    # the file before it was read.
+    def save(self, filename, items, stat):
+        filename = os.path.realpath(os.path.expanduser(filename))
+        return write_cache(
+            self.cachedir, self.path(filename), self.key(filename, stat),
+            items)
@@ -1,27 +1,109 @@
 # dbitem.py
-import re
 
 
 class DBItem():
 
+    # Databases can hold a great many items, keep them compact
+    __slots__ = ('_label', '_cmd', 'label_lower', 'cmd_lower', '_search_key',
+                 'tags')
+
+    # Interned tag sets, items with the same tags share one frozenset
+    _tagsets = {}
+
+    # Label text
+    @property
+    def label(self):
+        return self._label
+
+    @label.setter
+    def label(self, value):
+        self._label = value
+        self._update_keys()
+
+    # Command text
+    @property
+    def cmd(self):
+        return self._cmd
+
+    @cmd.setter
+    def cmd(self, value):
+        self._cmd = value
+        self._update_keys()
+
     # Auto detect and split labels/cmd
     def __init__(self, line, tags=None):
-        label = ""
-        post = re.match(r'.*(\[(.*)\])$', line)
-        pre = re.match(r'^(\[(.*)\])(.*)$', line)
-        if post:
-            label = post.group(2)
-            line = re.sub(r'(\[(.*)\])$', '', line)
-        elif pre:
-            label = pre.group(2)
-            line = re.sub(r'^(\[(.*)\])', '', line)
-        self.label = label.strip()
-        self.cmd = line.strip()
+        label, line = DBItem.parse(line)
+        self._label = label.strip()
+        self._cmd = line.strip()
+        self._update_keys()
+        self.tags = DBItem.tagset(tags)
+
+    # Convert items to plain (label, cmd, label_lower, cmd_lower) tuples
+    @staticmethod
+    def to_rows(items):
+        return [(x._label, x._cmd, x.label_lower, x.cmd_lower) for x in items]
+
+    # Quickly recreate untagged items from to_rows() tuples
+    @staticmethod
+    def from_rows(rows):
+        items = []
+        new = DBItem.__new__
+        notags = DBItem.tagset(None)
+        for label, cmd, label_lower, cmd_lower in rows:
+            item = new(DBItem)
+            item._label = label
+            item._cmd = cmd
+            item.label_lower = label_lower
+            item.cmd_lower = cmd_lower
+            item._search_key = None
+            item.tags = notags
+            items.append(item)
+        return items
+
+    # Get the shared frozenset for some tags
+    @staticmethod
+    def tagset(tags):
+        tags = frozenset(tags or ())
+        return DBItem._tagsets.setdefault(tags, tags)
+
+    # Add some tags to this item
+    def add_tags(self, tags):
         if tags:
-            self.tags = tags[:]
-        else:
-            self.tags = []
+            self.tags = DBItem.tagset(self.tags.union(tags))
+
+    # Refresh our lowercase search keys after a change
+    def _update_keys(self):
+        self.label_lower = self._label.lower()
+        self.cmd_lower = self._cmd.lower()
+        self._search_key = None
+
+    # Split a line into its (label, command) parts. A label is enclosed in
+    # square brackets at either the end "cmd [label]" or the start
+    # "[label] cmd" of the line, the end taking precedence.
+    @staticmethod
+    def parse(line):
+        # A single trailing newline is ignored, any others mean no label
+        text = line[:-1] if line.endswith('\n') else line
+        if '\n' in text:
+            return '', line
+
+        # Label at the end, runs from the last opening bracket. The command
+        # is everything before the first opening bracket.
+        if text.endswith(']'):
+            start = text.rfind('[', 0, -1)
+            if start >= 0:
+                return text[start+1:-1], text[:text.find('[')]
+
+        # Label at the start, runs to the last closing bracket
+        if text.startswith('['):
+            end = text.rfind(']')
+            if end > 0:
+                return text[1:end], text[end+1:]
+
+        return '', line
 
     # Return a string suitable for substring searching
     def search_key(self):
-        return "{0} {1}".format(self.label, self.cmd).lower()
+        if self._search_key is None:
+            self._search_key = "{0} {1}".format(self._label, self._cmd).lower()
+        return self._search_key
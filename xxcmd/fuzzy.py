@@ -0,0 +1,116 @@
+# fuzzy.py
+# fzf style fuzzy matching, where a search term matches any text
+# containing all of its characters in order
+import re
+import heapq
+from operator import itemgetter
+
+
+# Score for each matched character
+SCORE_MATCH = 16
+# Penalties for unmatched characters between matched ones
+SCORE_GAP_START = -3
+SCORE_GAP_EXTENSION = -1
+# Bonus for matching the first character of a word
+BONUS_BOUNDARY = 8
+# Bonus for each match which follows on from the last
+BONUS_CONSECUTIVE = 4
+# Boundary bonus multiplier for the first character of the search term
+BONUS_FIRST_CHAR_MULTIPLIER = 2
+# Bonus for matching a label rather than a command
+BONUS_LABEL = 32
+
+
+class FuzzyMatcher():
+
+    def __init__(self, term):
+        self.term = term
+        # Match up to the first occurrence of each character in turn.
+        # Anchored and without lazy repeats, so failing to match is
+        # quick, even on long text.
+        self.pattern = re.compile(''.join(
+            '[^{0}]*{0}'.format(re.escape(x)) for x in term), re.DOTALL)
+
+    # Find the end of the earliest match in some text, or None
+    def match(self, text):
+        found = self.pattern.match(text)
+        if found:
+            return found.end()
+
+    # Check if an item matches our term
+    def match_item(self, item, labels=False, commands=False):
+        match = self.pattern.match
+        return bool(labels and item.label and match(item.label_lower) or
+                    commands and match(item.cmd_lower))
+
+    # Score some text against our term, or None if it doesn't match
+    def score(self, text):
+        end = self.match(text)
+        if end is None:
+            return None
+
+        # Walk back from the end of the earliest match to find the
+        # shortest match
+        positions = []
+        pos = end
+        for char in reversed(self.term):
+            pos = text.rindex(char, 0, pos)
+            positions.append(pos)
+        positions.reverse()
+
+        score = 0
+        last = None
+        for i, pos in enumerate(positions):
+            bonus = 0
+            if pos == 0 or not text[pos-1].isalnum():
+                bonus = BONUS_BOUNDARY
+                if i == 0:
+                    bonus *= BONUS_FIRST_CHAR_MULTIPLIER
+            if last is not None:
+                if pos == last + 1:
+                    bonus += BONUS_CONSECUTIVE
+                else:
+                    score += (SCORE_GAP_START +
+                              SCORE_GAP_EXTENSION * (pos - last - 2))
+            score += SCORE_MATCH + bonus
+            last = pos
+        return score
+
+    # Score an item against our term, or None if it doesn't match
+    def score_item(self, item, labels=False, commands=False):
+        best = None
+        if labels and item.label:
+            best = self.score(item.label_lower)
+            if best is not None:
+                best += BONUS_LABEL
+        if commands:
+            score = self.score(item.cmd_lower)
+            if score is not None and (best is None or score > best):
+                best = score
+        return best
+
+    # Get the items which match our term, without scoring them
+    def filter(self, items, labels=False, commands=False):
+        match = self.pattern.match
+        results = []
+        for item in items:
+            if (labels and item.label and match(item.label_lower) or
+                    commands and match(item.cmd_lower)):
+                results.append(item)
+        return results
+
+    # Rank matching items best first, keeping only the best few if we're
+    # given a limit. Equally good matches are kept in their original order.
+    def rank(self, items, labels=False, commands=False, limit=0):
+        scored = []
+        for item in items:
+            score = self.score_item(item, labels, commands)
+            if score is not None:
+                # Shorter matches are better
+                scored.append(((score, -len(item.label)), item))
+        key = itemgetter(0)
+        if limit and limit < len(scored):
+            scored = heapq.nlargest(limit, scored, key=key)
+        else:
+            scored.sort(key=key, reverse=True)
+        return [x[1] for x in scored]
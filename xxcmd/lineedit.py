@@ -11,31 +11,31 @@ class LineEdit():
 
     @property
     def value(self):
+        if self._linetext is None:
+            self._linetext = (''.join(self._before) +
+                              ''.join(reversed(self._after)))
         return self._linetext
 
     @property
     def cursor(self):
-        return self._cursor_pos
+        return len(self._before)
 
     def __init__(self):
         self.clear()
 
     # Clear everything
     def clear(self):
-        self._linetext = ''
+        self._set_text('')
         self._history = []
-        self._cursor_default()
 
     # Set our entire line text as a string
     def set_value(self, value, use_history=True):
         # Remember the current value
-        self._history.append(self._linetext)
+        self._history.append(self.value)
         if len(self._history) > 20:
             self._history = self._history[1:]
-        # Set the new value
-        self._linetext = value
-        # Set cursor
-        self._cursor_default()
+        # Set the new value, with the cursor at the end
+        self._set_text(value)
 
     # Restore a previous input line
     def pop_value(self):
@@ -44,69 +44,91 @@ class LineEdit():
         else:
             self.clear()
 
-    # Set the default cursor position
-    def _cursor_default(self):
-        # Default cursor position
-        self._cursor_pos = len(self._linetext)
+    # Our line is kept as a gap buffer, the text before the cursor and the
+    # text after it (reversed) in lists, so typing, deleting and moving
+    # the cursor don't copy the whole line
+    def _set_text(self, value):
+        self._before = list(value)
+        self._after = []
+        self._linetext = value
+
+    # Move the cursor to a position in our line
+    def _move_cursor(self, pos):
+        pos = max(0, min(pos, len(self._before) + len(self._after)))
+        while len(self._before) > pos:
+            self._after.append(self._before.pop())
+        while len(self._before) < pos:
+            self._before.append(self._after.pop())
 
     # String representation
     def __str__(self):
-        return self._linetext
+        return self.value
 
     # Add a character to our line data at current cursor position
     def addchar(self, value):
-        self._linetext = (self._linetext[:self._cursor_pos] +
-                          value + self._linetext[self._cursor_pos:])
-        self._cursor_pos += 1
+        self.insert(value)
+
+    # Add some text to our line data at current cursor position, e.g. when
+    # it's pasted
+    def insert(self, text):
+        if text:
+            self._before.extend(text)
+            # Typing at the end of the line just extends any cached value
+            if self._linetext is not None and not self._after:
+                self._linetext += text
+            else:
+                self._linetext = None
 
     # Delete a character from our line from the current cursor position
     def delchar(self):
         # We can't delete from nothing
-        if not self._linetext:
+        if not self._before:
             return
-        self._linetext = self._linetext[:self._cursor_pos -
-                                        1] + self._linetext[self._cursor_pos:]
-        self._cursor_pos -= 1
+        self._before.pop()
+        if self._linetext is not None and not self._after:
+            self._linetext = self._linetext[:-1]
+        else:
+            self._linetext = None
 
     # Move cursor left
     def left(self, step=0):
+        pos = self.cursor
         if step == LineEdit.CHARACTER:
-            self._cursor_pos -= 1
+            pos -= 1
         elif step == LineEdit.LINE:
-            self._cursor_pos = 0
+            pos = 0
         elif step == LineEdit.WORD:
             # Move to start of next word, backwards
+            text = self.value
             foundchar = False
             while True:
-                self._cursor_pos -= 1
-                if self._cursor_pos < 0:
+                pos -= 1
+                if pos < 0:
                     break
-                if self._linetext[self._cursor_pos] != ' ':
+                if text[pos] != ' ':
                     foundchar = True
-                if foundchar and self._linetext[self._cursor_pos] == ' ':
-                    self._cursor_pos += 1
+                if foundchar and text[pos] == ' ':
+                    pos += 1
                     break
-
-        if self._cursor_pos < 0:
-            self._cursor_pos = 0
+        self._move_cursor(pos)
 
     # Move cursor right
     def right(self, step=0):
+        pos = self.cursor
         if step == LineEdit.CHARACTER:
-            self._cursor_pos += 1
+            pos += 1
         elif step == LineEdit.LINE:
-            self._cursor_pos = len(self._linetext)
+            pos = len(self._before) + len(self._after)
         elif step == LineEdit.WORD:
             # Move to start of next word
+            text = self.value
             foundspace = False
             while True:
-                self._cursor_pos += 1
-                if self._cursor_pos >= len(self._linetext):
+                pos += 1
+                if pos >= len(text):
                     break
-                if self._linetext[self._cursor_pos] == ' ':
+                if text[pos] == ' ':
                     foundspace = True
-                if foundspace and self._linetext[self._cursor_pos] != ' ':
+                if foundspace and text[pos] != ' ':
                     break
-
-        if self._cursor_pos > len(self._linetext):
-            self._cursor_pos = len(self._linetext)
+        self._move_cursor(pos)
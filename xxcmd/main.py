@@ -1,14 +1,33 @@
 # main.py
-import argparse
 import os
 from .cmdmanager import CmdManager
-import xxcmd
 
 
 __version__ = "0.10.1"
 
+# Our git version, if we're running from a git repo
+_dev_version = None
+
+
+# Inspect git version if we're in a git repo
+def dev_version():
+    global _dev_version
+    if _dev_version is None:
+        _dev_version = ''
+        thisdir = os.path.dirname(os.path.realpath(__file__))
+        if os.path.isdir(os.path.join(thisdir, os.pardir, '.git')):
+            from subprocess import check_output, CalledProcessError, DEVNULL
+            try:
+                ver = check_output(
+                    'git describe --tags'.split(), cwd=thisdir, stderr=DEVNULL)
+                _dev_version = ver.decode('utf-8').strip()
+            except (CalledProcessError, OSError):
+                pass  # don't care
+    return _dev_version
+
 
 def main():
+    import argparse
 
     # Create the parser and add arguments
     parser = argparse.ArgumentParser(
@@ -29,8 +48,8 @@ def main():
         help="Don't display the shortcut key help footer.")
 
     parser.add_argument(
-        '-i', '--import-url', nargs=1, metavar='URL',
-        help="Import a command database from the given URL. Merge "
+        '-i', '--import-url', nargs='+', action='append', metavar='URL',
+        help="Import command databases from the given URLs. Merge "
         "into existing database.")
 
     parser.add_argument(
@@ -81,6 +100,11 @@ def main():
         '-v', '--version', action='store_true',
         help="Display program version.")
 
+    parser.add_argument(
+        '-z', '--fuzzy', action='store_const', const=True,
+        help="Fuzzy search, matching any labels or commands which contain "
+        "the search characters in order. Best matches are listed first.")
+
     parser.add_argument(
         'search', nargs='*', metavar='SEARCH',
         help="Search for a matching command and run it immediately.")
@@ -96,7 +120,7 @@ def main():
 
     # Create our SSH Manager
     manager = CmdManager()
-    manager.ui.dev = xxcmd.__dev_version__
+    manager.ui.dev = dev_version
 
     # Switch database file?
     if args.db_file:
@@ -120,15 +144,14 @@ def main():
     if args.search_all:
         manager.config.search_labels_only = False
         manager.config.search_labels_first = False
+    if args.fuzzy:
+        manager.config.fuzzy_search = True
 
     # Key test?
     if args.key_test:  # pragma: no cover
         manager.ui.run_key_test()
         exit(0)
 
-    # Load db
-    manager.load_databases()
-
     if args.create_config:
         outfile = manager.config.save()
         if outfile:
@@ -139,25 +162,46 @@ def main():
             exit(1)
 
     if args.import_url:
-        if manager.import_database_url(args.import_url[0]):
-            print("Loaded data from URL")
-            exit(0)
-        else:
-            exit(1)
+        urls = [x for urls in args.import_url for x in urls]
+        manager.load_databases()
+        results = manager.import_database_urls(urls)
+        for result in results:
+            if not result:
+                continue
+            if result.not_modified:
+                print("URL not modified since last import: {0}".format(
+                    result.url))
+            print("Loaded data from URL: {0} added, {1} duplicates.".format(
+                result.added, result.duplicates))
+            print("Read {0} bytes, {1} lines in {2:.2f}s.".format(
+                result.bytes, result.lines, result.seconds))
+        exit(0 if all(results) else 1)
 
     if args.add:
-        if manager.add_database_entry(" ".join(args.add)):
+        with manager.lock_database():
+            manager.load_databases()
+            added = manager.add_database_entry(" ".join(args.add))
+        if added:
             print("Added command.")
             exit(0)
         else:
             print("Duplicate command not added.")
             exit(1)
 
+    # Stream the list straight from the database files
     if args.list:
-        manager.print_commands()
+        manager.print_commands(manager.iter_database())
         exit(0)
 
-    # Run the command manager UI
     if type(args.search) is list:
         args.search = ' '.join(args.search)
+
+    # Run a single matching command without loading everything
+    if args.search and manager.quick_run(args.search):
+        exit(0)
+
+    # Load db
+    manager.load_databases()
+
+    # Run the command manager UI
     manager.run(args.search)
@@ -0,0 +1,73 @@
+# resultview.py
+# Search results which are only sorted as far as anyone looks at them
+import heapq
+from operator import attrgetter
+
+
+# The fewest results we sort at once, more than fit on most screens
+MIN_SORTED = 100
+
+
+class ResultView():
+
+    def __init__(self, items=(), key=None, label_width=None):
+        if type(items) is not list:
+            items = list(items)
+        # All our results, in their original order
+        self._items = items
+        self._key = key
+        # The first of our results in sorted order, equal items keep
+        # their original order
+        self._sorted = [] if key else items
+        # Length of our longest label, if we know it
+        self._label_width = label_width
+
+    def __len__(self):
+        return len(self._items)
+
+    def __bool__(self):
+        return bool(self._items)
+
+    def __getitem__(self, idx):
+        if type(idx) is slice:
+            self._extend(idx.indices(len(self._items))[1])
+        else:
+            if idx < 0:
+                idx += len(self._items)
+            self._extend(idx + 1)
+        return self._sorted[idx]
+
+    def __iter__(self):
+        self._extend(len(self._items))
+        return iter(self._sorted)
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    # Our results in their original order, for when the order doesn't
+    # matter
+    def unordered(self):
+        return self._items
+
+    # Length of our longest label, worked out just once
+    def label_width(self):
+        if self._label_width is None:
+            self._label_width = 0
+            if self._items:
+                self._label_width = max(
+                    map(len, map(attrgetter('label'), self._items)))
+        return self._label_width
+
+    # Sort at least the first count results
+    def _extend(self, count):
+        if len(self._sorted) >= count or self._key is None:
+            return
+        # Sort more than we need, so scrolling doesn't sort again for a
+        # while
+        count = max(count, 2 * len(self._sorted), MIN_SORTED)
+        # Picking out the first few is only quicker than sorting them all
+        # when there are a lot more of them
+        if count * 4 >= len(self._items):
+            self._sorted = sorted(self._items, key=self._key)
+        else:
+            self._sorted = heapq.nsmallest(count, self._items, key=self._key)
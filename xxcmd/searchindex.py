@@ -0,0 +1,87 @@
+# searchindex.py
+
+
+# Get the set of trigrams in some text
+def trigrams(text):
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+# A trigram index of lowercase item labels and commands. Any item
+# containing a search term must contain all of the term's trigrams, so
+# the index quickly finds candidates for substring searching.
+class TrigramIndex():
+
+    # Shortest search term the index can help with
+    MIN_TERM = 3
+
+    def __init__(self, items=()):
+        # Trigram to set of items, for labels and for commands
+        self.labels = {}
+        self.commands = {}
+        # Order items were added, so candidates keep database order
+        self._order = {}
+        self._counter = 0
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._order)
+
+    # Add an item to the index
+    def add(self, item):
+        if item not in self._order:
+            self._order[item] = self._counter
+            self._counter += 1
+        self._post(self.labels, item.label_lower, item)
+        self._post(self.commands, item.cmd_lower, item)
+
+    # Remove an item from the index
+    def remove(self, item):
+        self.discard(item)
+        self._order.pop(item, None)
+
+    # Remove the postings for an item but remember its position, call
+    # before editing an item and then add() it again afterwards
+    def discard(self, item):
+        self._unpost(self.labels, item.label_lower, item)
+        self._unpost(self.commands, item.cmd_lower, item)
+
+    # Find candidate items which may contain a search term, in the order
+    # they were added. Returns None if the term is too short to index.
+    def candidates(self, searchterm, labels=False, commands=False):
+        if len(searchterm) < TrigramIndex.MIN_TERM:
+            return None
+        grams = trigrams(searchterm)
+        found = set()
+        if labels:
+            found |= self._lookup(self.labels, grams)
+        if commands:
+            found |= self._lookup(self.commands, grams)
+        return sorted(found, key=self._order.__getitem__)
+
+    # Find the items which contain all of some trigrams
+    def _lookup(self, postings, grams):
+        sets = []
+        for gram in grams:
+            items = postings.get(gram)
+            if not items:
+                return set()
+            sets.append(items)
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def _post(self, postings, text, item):
+        for gram in trigrams(text):
+            items = postings.get(gram)
+            if items is None:
+                postings[gram] = {item}
+            else:
+                items.add(item)
+
+    def _unpost(self, postings, text, item):
+        for gram in trigrams(text):
+            items = postings.get(gram)
+            if items is not None:
+                items.discard(item)
+                if not items:
+                    del postings[gram]
@@ -0,0 +1,47 @@
+# sorteditems.py
+# Database items kept in sort order as they are added, changed and removed
+from bisect import bisect_left, bisect_right
+from operator import attrgetter
+
+
+class SortedItems():
+
+    def __init__(self, items, attr):
+        # The item attribute we sort by
+        self.attr = attr
+        self.key = attrgetter(attr)
+        # Our items in sort order, and the (key, order) we sorted them by.
+        # Equal items are kept in database order, the order they were
+        # given to us and then added.
+        keys = list(map(self.key, items))
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.items = [items[x] for x in order]
+        self.keys = [(keys[x], x) for x in order]
+        self._next_order = len(keys)
+
+    # Add an item, order is its place amongst equal items if it's been
+    # removed and is being added back, e.g. after being changed
+    def add(self, item, order=None):
+        if order is None:
+            order = self._next_order
+            self._next_order += 1
+        key = (self.key(item), order)
+        idx = bisect_right(self.keys, key)
+        self.keys.insert(idx, key)
+        self.items.insert(idx, item)
+
+    # Remove an item, key is what it was sorted by if it has since changed
+    # Returns the item's order to add it back with, or None if we don't
+    # have it
+    def remove(self, item, key=None):
+        if key is None:
+            key = self.key(item)
+        idx = bisect_left(self.keys, (key,))
+        while idx < len(self.keys) and self.keys[idx][0] == key:
+            if self.items[idx] is item:
+                order = self.keys[idx][1]
+                del self.keys[idx]
+                del self.items[idx]
+                return order
+            idx += 1
+        return None
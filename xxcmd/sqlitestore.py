@@ -0,0 +1,224 @@
+# sqlitestore.py
+# Storage of a command database in SQLite
+import sqlite3
+from .dbitem import DBItem
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS items (
+    id INTEGER PRIMARY KEY,
+    cmd TEXT NOT NULL,
+    label TEXT NOT NULL,
+    cmd_lower TEXT NOT NULL,
+    label_lower TEXT NOT NULL,
+    tags TEXT NOT NULL DEFAULT ''
+);
+CREATE UNIQUE INDEX IF NOT EXISTS items_key ON items (cmd, label);
+CREATE INDEX IF NOT EXISTS items_label ON items (label);
+CREATE INDEX IF NOT EXISTS items_label_lower ON items (label_lower);
+CREATE INDEX IF NOT EXISTS items_cmd_lower ON items (cmd_lower);
+'''
+
+# Full text index of our lowercase text, matching substrings
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    label_lower, cmd_lower, content='items', content_rowid='id',
+    tokenize='trigram case_sensitive 1'
+);
+CREATE TRIGGER IF NOT EXISTS items_fts_insert AFTER INSERT ON items BEGIN
+    INSERT INTO items_fts (rowid, label_lower, cmd_lower)
+    VALUES (new.id, new.label_lower, new.cmd_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS items_fts_delete AFTER DELETE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, label_lower, cmd_lower)
+    VALUES ('delete', old.id, old.label_lower, old.cmd_lower);
+END;
+CREATE TRIGGER IF NOT EXISTS items_fts_update AFTER UPDATE ON items BEGIN
+    INSERT INTO items_fts (items_fts, rowid, label_lower, cmd_lower)
+    VALUES ('delete', old.id, old.label_lower, old.cmd_lower);
+    INSERT INTO items_fts (rowid, label_lower, cmd_lower)
+    VALUES (new.id, new.label_lower, new.cmd_lower);
+END;
+'''
+
+# Columns we can sort search results by
+SORT_COLUMNS = ('label', 'label_lower', 'cmd', 'cmd_lower')
+
+# Shortest search term the full text index can help with
+FTS_MIN_TERM = 3
+
+
+class SQLiteStore():
+
+    def __init__(self, filename, readonly=False):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        # Items we only read don't need our schema, or the file writing
+        if readonly:
+            self.db.execute('PRAGMA query_only = ON')
+            self.fts = False
+            self._items = {}
+            self._ids = {}
+            return
+        self.db.executescript(SCHEMA)
+        # Full text search needs a recent SQLite with FTS5
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False
+        self.db.commit()
+        # Our items by row id, and row ids by item
+        self._items = {}
+        self._ids = {}
+
+    def __contains__(self, item):
+        return item in self._ids
+
+    def __len__(self):
+        return self.db.execute('SELECT count(*) FROM items').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    # Lazily iterate the items in the database, without tracking them
+    def iter_items(self):
+        cursor = self.db.execute(
+            'SELECT label, cmd, label_lower, cmd_lower, tags FROM items '
+            'ORDER BY id')
+        for row in cursor:
+            item = DBItem.from_rows([row[:4]])[0]
+            item.add_tags(row[4].split())
+            yield item
+
+    # Load all our items, these are then kept up to date by our changes
+    def load(self):
+        self._items.clear()
+        self._ids.clear()
+        cursor = self.db.execute(
+            'SELECT id, label, cmd, label_lower, cmd_lower, tags FROM items '
+            'ORDER BY id')
+        items = []
+        for row in cursor:
+            item = DBItem.from_rows([row[1:5]])[0]
+            item.add_tags(row[5].split())
+            self._track(row[0], item)
+            items.append(item)
+        return items
+
+    # Add some items, ignoring any we already have
+    def add(self, items):
+        items = list(items)
+        if not items:
+            return
+        with self.db:
+            self._insert(items)
+
+    # Make our items match some items, removing any others, all at once
+    def sync(self, items):
+        items = list(items)
+        keys = set((x.cmd, x.label) for x in items)
+        with self.db:
+            stale = [
+                rowid for rowid, cmd, label
+                in self.db.execute('SELECT id, cmd, label FROM items')
+                if (cmd, label) not in keys]
+            for rowid in stale:
+                self.db.execute('DELETE FROM items WHERE id = ?', (rowid,))
+                self._untrack(rowid)
+            self._insert(items)
+
+    # Stop tracking some items, they won't be found by searches
+    def forget(self, items):
+        for item in list(items):
+            rowid = self._ids.get(item)
+            if rowid is not None:
+                self._untrack(rowid)
+
+    # Remove the items with some (cmd, label) keys
+    def remove(self, keys):
+        with self.db:
+            for cmd, label in keys:
+                row = self.db.execute(
+                    'SELECT id FROM items WHERE cmd = ? AND label = ?',
+                    (cmd, label)).fetchone()
+                if row:
+                    self.db.execute('DELETE FROM items WHERE id = ?', row)
+                    self._untrack(row[0])
+
+    # Update the item which had an old (cmd, label) key
+    def update(self, oldkey, item):
+        with self.db:
+            row = self.db.execute(
+                'SELECT id FROM items WHERE cmd = ? AND label = ?',
+                oldkey).fetchone()
+            if not row:
+                return self.add([item])
+            try:
+                self.db.execute(
+                    'UPDATE items SET cmd = ?, label = ?, cmd_lower = ?, '
+                    'label_lower = ?, tags = ? WHERE id = ?',
+                    self._values(item) + row)
+            except sqlite3.IntegrityError:
+                # It's now a duplicate of another item
+                self.db.execute('DELETE FROM items WHERE id = ?', row)
+                self._untrack(row[0])
+                return
+            self._untrack(row[0])
+            self._track(row[0], item)
+
+    # Search our items for a lowercase search term, in our labels and/or
+    # commands, sorted by one of SORT_COLUMNS or in the order they were
+    # added. Returns a list of our items.
+    def search(self, searchterm, labels=False, commands=False, sort=None):
+        where = []
+        params = []
+        if labels:
+            where.append("(label != '' AND instr(label_lower, ?) > 0)")
+            params.append(searchterm)
+        if commands:
+            where.append("instr(cmd_lower, ?) > 0")
+            params.append(searchterm)
+        sql = 'SELECT id FROM items WHERE ({0})'.format(' OR '.join(where))
+
+        # Use the full text index to find candidates
+        if self.fts and len(searchterm) >= FTS_MIN_TERM:
+            columns = []
+            if labels:
+                columns.append('label_lower')
+            if commands:
+                columns.append('cmd_lower')
+            sql += (' AND id IN (SELECT rowid FROM items_fts '
+                    'WHERE items_fts MATCH ?)')
+            params.append('{{{0}}} : "{1}"'.format(
+                ' '.join(columns), searchterm.replace('"', '""')))
+
+        if sort in SORT_COLUMNS:
+            sql += ' ORDER BY {0}, id'.format(sort)
+        else:
+            sql += ' ORDER BY id'
+        items = self._items
+        return [items[x] for x, in self.db.execute(sql, params) if x in items]
+
+    # Insert some items, ignoring any we already have
+    def _insert(self, items):
+        for item in items:
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO items '
+                '(cmd, label, cmd_lower, label_lower, tags) '
+                'VALUES (?, ?, ?, ?, ?)', self._values(item))
+            if cursor.rowcount:
+                self._track(cursor.lastrowid, item)
+
+    def _values(self, item):
+        return (item.cmd, item.label, item.cmd_lower, item.label_lower,
+                ' '.join(sorted(item.tags)))
+
+    def _track(self, rowid, item):
+        self._items[rowid] = item
+        self._ids[item] = rowid
+
+    def _untrack(self, rowid):
+        item = self._items.pop(rowid, None)
+        if item is not None:
+            self._ids.pop(item, None)
@@ -0,0 +1,153 @@
+# urlfeed.py
+# Streaming download of command databases from URLs, with an on-disk
+# cache of feed validators so unchanged feeds aren't downloaded again
+import os
+import time
+import codecs
+from .dbitem import DBItem
+from .dbcache import cache_path, read_cache, write_cache
+
+
+# Change this if the cached data format changes
+CACHE_VERSION = 1
+
+# How much of a response we read at a time
+CHUNK_SIZE = 65536
+
+
+# What happened when we fetched a feed
+class FeedStats():
+
+    def __init__(self, url):
+        self.url = url
+        # Bytes downloaded
+        self.bytes = 0
+        # Non-empty lines read
+        self.lines = 0
+        # Seconds taken to fetch and parse the feed
+        self.seconds = 0.0
+        # True if the server told us the feed hasn't changed
+        self.not_modified = False
+        # Why we couldn't fetch the feed, if we couldn't
+        self.error = None
+        # Result of merging the feed into our database
+        self.added = 0
+        self.duplicates = 0
+
+
+class UrlFeed():
+
+    def __init__(self, url, cachedir=None, timeout=None):
+        self.url = url
+        # Seconds to wait on the server before giving up
+        self.timeout = timeout
+        self.cachedir = cachedir and os.path.expanduser(cachedir)
+        self.stats = FeedStats(url)
+        # Validators from the last time we downloaded this feed
+        self.etag = None
+        self.last_modified = None
+        # The items we got from the feed
+        self.items = None
+
+    # Cache filename for this feed
+    def path(self):
+        return cache_path(self.cachedir, 'url', self.url, '.feed')
+
+    # Get the items we cached for this feed, None if we have none
+    def load_cache(self):
+        if not self.cachedir:
+            return None
+        # Missing or broken caches just mean a full download
+        cached = read_cache(
+            self.path(), lambda x: x[:2] == (CACHE_VERSION, self.url))
+        if cached is None:
+            return None
+        (version, url, self.etag, self.last_modified), items = cached
+        return items
+
+    # Seconds since we last checked this feed, None if we never have
+    def cache_age(self):
+        if not self.cachedir:
+            return None
+        try:
+            return time.time() - os.stat(self.path()).st_mtime
+        except OSError:
+            return None
+
+    # Cache the items and validators for this feed
+    def save_cache(self, items):
+        if not self.cachedir:
+            return False
+        return write_cache(
+            self.cachedir, self.path(),
+            (CACHE_VERSION, self.url, self.etag, self.last_modified), items)
+
+    # Open the feed, returns None if it hasn't changed since we cached it
+    def open(self, conditional=False):
+        if self.url.startswith('file://'):
+            return open(os.path.expanduser(self.url[7:]), "rb")
+
+        import urllib.request
+        import urllib.error
+        request = urllib.request.Request(self.url)
+        if conditional and self.etag:
+            request.add_header('If-None-Match', self.etag)
+        if conditional and self.last_modified:
+            request.add_header('If-Modified-Since', self.last_modified)
+        try:
+            response = urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as ex:
+            if ex.code == 304:
+                return None
+            raise
+        self.etag = response.headers.get('ETag')
+        self.last_modified = response.headers.get('Last-Modified')
+        return response
+
+    # Decode and split a stream into stripped lines as it arrives
+    def iter_lines(self, stream):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        pending = ''
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            self.stats.bytes += len(data)
+            text = pending + decoder.decode(data, not data)
+            # Keep a trailing \r in case the next chunk starts with \n
+            if data and text.endswith('\r'):
+                pending = '\r'
+                text = text[:-1]
+            else:
+                pending = ''
+            # Support any style of line endings
+            lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+            if data:
+                pending = lines.pop() + pending
+            for line in lines:
+                line = line.strip()
+                if line:
+                    self.stats.lines += 1
+                    yield line
+            if not data:
+                return
+
+    # Get the items in this feed, from our cache if it hasn't changed
+    def get_items(self):
+        start = time.monotonic()
+        cached = self.load_cache()
+        stream = self.open(cached is not None)
+        if stream is None:
+            self.stats.not_modified = True
+            items = cached
+            # Remember when we last checked
+            try:
+                os.utime(self.path())
+            except OSError:
+                pass
+        else:
+            with stream:
+                items = [DBItem(x) for x in self.iter_lines(stream)]
+            if not self.url.startswith('file://'):
+                self.save_cache(items)
+        self.stats.seconds = time.monotonic() - start
+        self.items = items
+        return items
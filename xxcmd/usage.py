@@ -0,0 +1,99 @@
+# usage.py
+# A compact log of when commands are run, used to rank the commands we
+# run most often and most recently first
+import os
+import time
+from .dbitem import DBItem
+
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+
+# Rewrite the log once it holds this many more records than commands
+COMPACT_SLACK = 100
+
+
+class UsageStore():
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        # Run (count, last run time) of each (cmd, label)
+        self.stats = {}
+
+    # Record that an item was run, appending to our log so we never have
+    # to rewrite anything whilst the user waits for their command
+    def record(self, item, now=None):
+        if now is None:
+            now = time.time()
+        key = (item.cmd, item.label)
+        count, last = self.stats.get(key, (0, 0))
+        self.stats[key] = (count + 1, now)
+        with open(self.filename, "at", encoding='utf-8') as f:
+            f.write(self._format(key, 1, now))
+
+    # A record of some runs of an item
+    def _format(self, key, count, last):
+        return "{0} {1} {2} [{3}]\n".format(int(last), count, key[0], key[1])
+
+    # Load our log, rewriting it if it's grown too large. Returns True if
+    # there was a log to load.
+    def load(self):
+        self.stats = {}
+        try:
+            infile = open(self.filename, "rt", encoding='utf-8')
+        except OSError:
+            return False
+        records = 0
+        with infile:
+            for line in infile:
+                parts = line.split(' ', 2)
+                # Skip anything we didn't write, e.g. a partly written line
+                if (len(parts) < 3 or not parts[0].isdigit() or
+                        not parts[1].isdigit()):
+                    continue
+                records += 1
+                item = DBItem(parts[2])
+                key = (item.cmd, item.label)
+                count, last = self.stats.get(key, (0, 0))
+                self.stats[key] = (
+                    count + int(parts[1]), max(last, int(parts[0])))
+        if records > len(self.stats) + COMPACT_SLACK:
+            self.compact()
+        return True
+
+    # Rewrite our log with a single record for each item
+    def compact(self):
+        import tempfile
+        dirname = os.path.dirname(self.filename) or '.'
+        try:
+            handle, tmpname = tempfile.mkstemp(dir=dirname)
+        except OSError:
+            return False
+        try:
+            with os.fdopen(handle, "wt", encoding='utf-8') as outfile:
+                outfile.writelines(
+                    self._format(key, count, last)
+                    for key, (count, last) in self.stats.items())
+            os.replace(tmpname, self.filename)
+        except OSError:
+            os.unlink(tmpname)
+            return False
+        return True
+
+    # How often and how recently an item has been run, commands run more
+    # often score higher and recent runs count for more
+    def frecency(self, item, now=None):
+        count, last = self.stats.get((item.cmd, item.label), (0, 0))
+        if not count:
+            return 0
+        if now is None:
+            now = time.time()
+        age = now - last
+        if age < HOUR:
+            return count * 4
+        if age < DAY:
+            return count * 2
+        if age < WEEK:
+            return count / 2
+        return count / 4